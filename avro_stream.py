@@ -0,0 +1,119 @@
+import os
+from interval_index import record_intervals
+from output_modes import apply_output_modes
+from pipeline_metrics import count_rows, stage
+from sensor_decode import decode_raw_data
+
+## Stream every record of an Avro file through the sensor decoders.
+# An Empatica file normally holds a single datum, but longer recordings and
+# concatenated exports hold several, spread over several Avro blocks. The
+# readers below walk all of them lazily, so only the record being decoded is
+# held in memory and nothing after the first datum is dropped.
+#
+# Two interchangeable readers produce the same records: the compiled fastavro
+# decoder when it is installed, and the pure-Python reference implementation
+# (avro.datafile.DataFileReader + avro.io.DatumReader) otherwise. Both hand
+# back plain lists, which sensor_decode turns into NumPy arrays in one pass.
+
+
+def iter_records_fastavro(avro_file_path):
+    """Yield every datum of an Avro file using the compiled fastavro decoder."""
+    import fastavro
+    with open(avro_file_path, "rb") as f:
+        yield from fastavro.reader(f)
+
+
+def iter_records_avro(avro_file_path):
+    """Yield every datum of an Avro file using the reference avro package."""
+    from avro.datafile import DataFileReader
+    from avro.io import DatumReader
+    with open(avro_file_path, "rb") as f:
+        reader = DataFileReader(f, DatumReader())
+        try:
+            yield from reader
+        finally:
+            reader.close()
+
+
+# Available readers, fastest first
+AVRO_READERS = {
+    "fastavro": iter_records_fastavro,
+    "avro": iter_records_avro,
+}
+
+
+def default_reader():
+    """Name of the fastest reader that can be imported here."""
+    try:
+        import fastavro  # noqa: F401
+        return "fastavro"
+    except ImportError:
+        return "avro"
+
+
+def iter_records(avro_file_path, reader=None):
+    """Yield every datum of an Avro file, block by block.
+
+    `reader` is a key of AVRO_READERS; by default fastavro is used when it is
+    installed and the avro package otherwise.
+    """
+    if reader is None:
+        reader = default_reader()
+    if reader not in AVRO_READERS:
+        raise ValueError(f"Unknown Avro reader {reader!r}; expected one of {sorted(AVRO_READERS)}.")
+    return AVRO_READERS[reader](avro_file_path)
+
+
+def iter_sensor_chunks(avro_file_path, reader=None, output_modes=None, intervals=None):
+    """Yield the decoded sensors of each record of an Avro file, one chunk at a time.
+
+    `output_modes` ({sensor: mode}, see output_modes.py) reduces sensors as
+    they are decoded. The [start, end) of each record's sensors (see
+    interval_index.py) are appended to the `intervals` list when one is given.
+    """
+    records = iter_records(avro_file_path, reader)
+    nbytes = os.path.getsize(avro_file_path)
+    while True:
+        with stage("read_avro", nbytes=nbytes) as counts:
+            record = next(records, None)
+            counts['rows'] = record is not None
+        if record is None:
+            return
+        nbytes = 0
+        with stage("decode") as counts:
+            sensors = decode_raw_data(record["rawData"])
+            counts['rows'] = count_rows(sensors)
+        if intervals is not None:
+            intervals.append(record_intervals(sensors, record["rawData"]))
+        if output_modes:
+            with stage("output_modes"):
+                sensors = apply_output_modes(sensors, record["rawData"], output_modes)
+        yield sensors
+
+
+def compare_readers(avro_file_path, readers=("fastavro", "avro")):
+    """Check that the given readers return identical rawData for a file.
+
+    Returns a list of (reader, record index, sensor) mismatches, empty when
+    every reader agrees with the first one.
+    """
+    records = {reader: list(iter_records(avro_file_path, reader)) for reader in readers}
+    expected = records[readers[0]]
+    mismatches = []
+    for reader in readers[1:]:
+        if len(records[reader]) != len(expected):
+            mismatches.append((reader, None, "record count"))
+            continue
+        for i, (got, want) in enumerate(zip(records[reader], expected)):
+            for sensor in want["rawData"]:
+                if got["rawData"].get(sensor) != want["rawData"][sensor]:
+                    mismatches.append((reader, i, sensor))
+    return mismatches
+
+
+if __name__ == "__main__":
+    # Example usage: python avro_stream.py file1.avro [file2.avro ...]
+    import sys
+    for path in sys.argv[1:]:
+        mismatches = compare_readers(path)
+        print(f"{path}: {'readers agree' if not mismatches else mismatches}")
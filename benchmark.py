@@ -0,0 +1,328 @@
+import argparse
+import contextlib
+import glob
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import avro_to_csv
+import avro_to_csv_with_ID
+import empatica_convert
+from avro_stream import AVRO_READERS, default_reader, iter_records
+from csv_writers import csv_writers
+from output_backends import OUTPUT_FORMATS
+from pipeline_metrics import peak_rss_mb
+from sensor_decode import decode_raw_data
+
+## Benchmarks of the converters on synthetic Empatica v6 Avro files.
+# make_fixture_tree() writes files that follow the rawData schema the
+# converters read, laid out like an Empatica sync folder:
+#   <root>/1/participant_data/<YYYY-MM-DD>/<id>-<serial>/raw_data/v6/<id>_<start>.avro
+# Each file holds DURATION_S seconds of every sensor at the rates in
+# SAMPLING_RATES. The benchmarks then time the converters end to end and the
+# three stages of a file separately:
+#   decode    - read the Avro records (fastavro or avro)
+#   transform - decode rawData into NumPy columns (sensor_decode)
+#   write     - append the columns to the output files
+# and report samples/s and peak RSS. Every case runs in a fresh process, so
+# its peak RSS is not inflated by the cases before it.
+#
+# Example: python benchmark.py --participants 2 --files 4 --workers 1 4
+
+# Length of one synthetic file; Empatica splits recordings into ~30 min files
+DURATION_S = 30 * 60
+
+# Sampling rate (Hz) of each uniformly sampled sensor
+SAMPLING_RATES = {
+    "accelerometer": 64.0,
+    "gyroscope": 64.0,
+    "eda": 4.0,
+    "temperature": 1.0,
+    "bvp": 64.0,
+    "steps": 0.2,
+}
+
+# Approximate number of events per second of the event streams
+EVENT_RATES = {
+    "tags": 1 / 600,
+    "systolicPeaks": 1.2,
+}
+
+# Converter modules that can be benchmarked
+CONVERTERS = {"avro_to_csv": avro_to_csv, "avro_to_csv_with_ID": avro_to_csv_with_ID}
+
+IMU_PARAMS = {"physicalMin": -16, "physicalMax": 16, "digitalMin": -32768, "digitalMax": 32767}
+
+
+def values_schema(name, item_type):
+    return {"type": "record", "name": name, "fields": [
+        {"name": "timestampStart", "type": "long"},
+        {"name": "samplingFrequency", "type": "float"},
+        {"name": "values", "type": {"type": "array", "items": item_type}},
+    ]}
+
+
+# The subset of the Empatica v6 schema that the converters read
+AVRO_SCHEMA = {
+    "type": "record", "name": "EmpaticaData", "namespace": "com.empatica.bench",
+    "fields": [{"name": "rawData", "type": {"type": "record", "name": "RawData", "fields": [
+        {"name": "accelerometer", "type": {"type": "record", "name": "Imu", "fields": [
+            {"name": "timestampStart", "type": "long"},
+            {"name": "samplingFrequency", "type": "float"},
+            {"name": "imuParams", "type": {"type": "record", "name": "ImuParams", "fields": [
+                {"name": name, "type": "int"} for name in IMU_PARAMS]}},
+            {"name": "x", "type": {"type": "array", "items": "int"}},
+            {"name": "y", "type": {"type": "array", "items": "int"}},
+            {"name": "z", "type": {"type": "array", "items": "int"}},
+        ]}},
+        {"name": "gyroscope", "type": "Imu"},
+        {"name": "eda", "type": values_schema("Eda", "float")},
+        {"name": "temperature", "type": values_schema("Temperature", "float")},
+        {"name": "tags", "type": {"type": "record", "name": "Tags", "fields": [
+            {"name": "tagsTimeMicros", "type": {"type": "array", "items": "long"}}]}},
+        {"name": "bvp", "type": values_schema("Bvp", "float")},
+        {"name": "systolicPeaks", "type": {"type": "record", "name": "SystolicPeaks", "fields": [
+            {"name": "peaksTimeNanos", "type": {"type": "array", "items": "long"}}]}},
+        {"name": "steps", "type": values_schema("Steps", "int")},
+    ]}}],
+}
+
+
+def synthetic_raw_data(start_us, duration_s, rng):
+    """Build one rawData record of `duration_s` seconds starting at `start_us`."""
+    def n_samples(sensor):
+        return int(duration_s * SAMPLING_RATES[sensor])
+
+    def imu(sensor):
+        n = n_samples(sensor)
+        xyz = rng.normal(0, 2000, size=(3, n)).clip(-32768, 32767).astype(np.int32)
+        return {"timestampStart": start_us, "samplingFrequency": SAMPLING_RATES[sensor],
+                "imuParams": dict(IMU_PARAMS),
+                "x": xyz[0].tolist(), "y": xyz[1].tolist(), "z": xyz[2].tolist()}
+
+    def values(sensor, values):
+        return {"timestampStart": start_us, "samplingFrequency": SAMPLING_RATES[sensor],
+                "values": values.tolist()}
+
+    def events(sensor, scale):
+        n = rng.poisson(duration_s * EVENT_RATES[sensor])
+        offsets = np.sort(rng.integers(0, duration_s * 1_000_000, size=n))
+        return ((start_us + offsets) * scale).tolist()
+
+    n_eda, n_temp, n_bvp = n_samples("eda"), n_samples("temperature"), n_samples("bvp")
+    return {
+        "accelerometer": imu("accelerometer"),
+        "gyroscope": imu("gyroscope"),
+        "eda": values("eda", np.abs(np.cumsum(rng.normal(0, 0.01, n_eda)) + 2.0)),
+        "temperature": values("temperature", 33.0 + rng.normal(0, 0.1, n_temp)),
+        "tags": {"tagsTimeMicros": events("tags", 1)},
+        "bvp": values("bvp", 50 * np.sin(np.arange(n_bvp) * (2 * np.pi * 1.2 / 64))
+                      + rng.normal(0, 5, n_bvp)),
+        "systolicPeaks": {"peaksTimeNanos": events("systolicPeaks", 1000)},
+        "steps": values("steps", rng.integers(0, 12, n_samples("steps"))),
+    }
+
+
+def write_synthetic_avro(avro_file_path, start_s, duration_s=DURATION_S, records=1, seed=0):
+    """Write an Avro file of `records` consecutive rawData records."""
+    rng = np.random.default_rng(seed)
+    data = [{"rawData": synthetic_raw_data(int((start_s + i * duration_s) * 1_000_000),
+                                            duration_s, rng)}
+            for i in range(records)]
+    try:
+        import fastavro
+    except ImportError:
+        fastavro = None
+    with open(avro_file_path, "wb") as f:
+        if fastavro is not None:
+            fastavro.writer(f, fastavro.parse_schema(AVRO_SCHEMA), data)
+            return
+        from avro.datafile import DataFileWriter
+        from avro.io import DatumWriter
+        from avro.schema import parse
+        writer = DataFileWriter(f, DatumWriter(), parse(json.dumps(AVRO_SCHEMA)))
+        for datum in data:
+            writer.append(datum)
+        writer.close()
+
+
+def make_fixture_tree(root, participants=2, files=4, duration_s=DURATION_S, records=1,
+                      start_s=1728000000):
+    """Write `files` consecutive Avro files for each of `participants` participants.
+
+    Returns the list of files written.
+    """
+    paths = []
+    for p in range(participants):
+        participant_id = f"1-1-{p + 1:03d}"
+        for i in range(files):
+            file_start = start_s + i * duration_s * records
+            date = datetime.fromtimestamp(file_start, timezone.utc).strftime("%Y-%m-%d")
+            folder = os.path.join(root, "1", "participant_data", date,
+                                  f"{p + 1:03d}-BENCH{p:05d}", "raw_data", "v6")
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"{participant_id}_{file_start}.avro")
+            write_synthetic_avro(path, file_start, duration_s, records, seed=p * files + i)
+            paths.append(path)
+    return paths
+
+
+def count_samples(sensors):
+    """Number of values in decoded sensors; an x/y/z row counts as three."""
+    return sum(len(next(iter(columns.values()))) * max(len(columns) - 1, 1)
+               for columns in sensors.values())
+
+
+def time_stages(output_dir, avro_files, output_format="csv", reader=None):
+    """Time decode, transform and write separately over a list of Avro files."""
+    timings = {"decode": 0.0, "transform": 0.0, "write": 0.0}
+    with csv_writers(output_dir) as writers:
+        for avro_file in avro_files:
+            records = iter_records(avro_file, reader)
+            for chunk in itertools.count():
+                start = time.perf_counter()
+                record = next(records, None)
+                timings["decode"] += time.perf_counter() - start
+                if record is None:
+                    break
+
+                start = time.perf_counter()
+                sensors = decode_raw_data(record["rawData"])
+                timings["transform"] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                empatica_convert.write_sensors(avro_file, sensors, output_dir,
+                                               output_format, chunk, writers)
+                timings["write"] += time.perf_counter() - start
+        # The last buffers are written when the files are closed
+        start = time.perf_counter()
+    timings["write"] += time.perf_counter() - start
+    return {"seconds": sum(timings.values()), **timings}
+
+
+def time_process_avro_file(output_dir, avro_files, converter, output_format, reader):
+    """Time process_avro_file() of a converter over each file in turn."""
+    start = time.perf_counter()
+    for avro_file in avro_files:
+        CONVERTERS[converter].process_avro_file(avro_file, output_dir, output_format, reader)
+    return {"seconds": time.perf_counter() - start}
+
+
+def time_process_folder(output_dir, folder_path, converter, output_format, reader, workers):
+    """Time process_folder() of a converter over a whole fixture tree."""
+    start = time.perf_counter()
+    CONVERTERS[converter].process_folder(folder_path, output_dir, workers=workers,
+                                         output_format=output_format, reader=reader)
+    return {"seconds": time.perf_counter() - start}
+
+
+def run_case(name, fn, *args):
+    """Run fn(output_dir, *args) in this process with a fresh output directory."""
+    output_dir = tempfile.mkdtemp(prefix="empatica-bench-")
+    try:
+        # The converters report every file they process
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = fn(output_dir, *args)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    result["case"] = name
+    result["peak_rss_mb"] = peak_rss_mb()
+    children = peak_rss_mb(children=True)
+    if children:
+        result["peak_rss_mb"] = max(result["peak_rss_mb"], children)
+    return result
+
+
+def run_isolated(name, fn, *args):
+    """Run one benchmark case in a fresh process, so its peak RSS is its own."""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run_case, name, fn, *args).result()
+
+
+def fixture_samples(avro_files, reader=None):
+    """Total number of samples in a set of Avro files."""
+    return sum(count_samples(decode_raw_data(record["rawData"]))
+               for avro_file in avro_files for record in iter_records(avro_file, reader))
+
+
+def find_avro_files(folder_path):
+    return sorted(glob.glob(os.path.join(folder_path, "**", "*.avro"), recursive=True))
+
+
+def format_result(result):
+    """One report line: time, throughput, peak RSS and per-stage times."""
+    seconds = result["seconds"]
+    throughput = result["samples"] / seconds / 1e6
+    line = f"{result['case']:<45} {seconds:8.2f} s {throughput:8.2f} M samples/s"
+    if result.get("peak_rss_mb") is not None:
+        line += f" {result['peak_rss_mb']:8.0f} MiB peak"
+    stages = [f"{stage} {result[stage]:.2f} s" for stage in ("decode", "transform", "write")
+              if stage in result]
+    if stages:
+        line += "  (" + ", ".join(stages) + ")"
+    return line
+
+
+def run_benchmarks(folder_path, converter_names=("avro_to_csv_with_ID",), workers=(1,),
+                   output_format="csv", reader=None):
+    """Run every benchmark case over an existing fixture tree and return the results."""
+    avro_files = find_avro_files(folder_path)
+    reader = reader or default_reader()
+    samples = fixture_samples(avro_files, reader)
+
+    results = [run_isolated(f"stages ({reader}, {output_format})", time_stages, avro_files,
+                            output_format, reader)]
+    for converter in converter_names:
+        results.append(run_isolated(f"{converter}.process_avro_file",
+                                    time_process_avro_file, avro_files, converter,
+                                    output_format, reader))
+        for n in workers:
+            results.append(run_isolated(f"{converter}.process_folder workers={n}",
+                                        time_process_folder, folder_path, converter,
+                                        output_format, reader, n))
+    for result in results:
+        result["samples"] = samples
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Avro converters on synthetic Empatica v6 files.")
+    parser.add_argument("--participants", type=int, default=2)
+    parser.add_argument("--files", type=int, default=4, help="Avro files per participant")
+    parser.add_argument("--duration", type=int, default=DURATION_S,
+                        help="seconds of data per Avro record")
+    parser.add_argument("--records", type=int, default=1, help="Avro records per file")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1],
+                        help="process_folder worker counts to benchmark")
+    parser.add_argument("--converter", nargs="+", default=["avro_to_csv_with_ID"],
+                        choices=sorted(CONVERTERS))
+    parser.add_argument("--format", dest="output_format", default="csv",
+                        choices=["csv"] + sorted(OUTPUT_FORMATS))
+    parser.add_argument("--reader", choices=sorted(AVRO_READERS), default=None)
+    parser.add_argument("--fixtures", default=None,
+                        help="reuse or keep fixtures in this folder instead of a temporary one")
+    parser.add_argument("--json", default=None,
+                        help="also save the results to this JSON file, to compare runs")
+    args = parser.parse_args()
+
+    fixtures = args.fixtures or tempfile.mkdtemp(prefix="empatica-fixtures-")
+    try:
+        if not find_avro_files(fixtures):
+            print(f"Writing {args.participants * args.files} synthetic Avro files to {fixtures}...")
+            make_fixture_tree(fixtures, args.participants, args.files, args.duration, args.records)
+        results = run_benchmarks(fixtures, args.converter, args.workers, args.output_format,
+                                 args.reader)
+        for result in results:
+            print(format_result(result))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        if args.fixtures is None:
+            shutil.rmtree(fixtures, ignore_errors=True)
@@ -0,0 +1,142 @@
+import contextlib
+import csv
+import io
+import os
+import time
+from pipeline_metrics import stage
+
+## Sensor CSV files held open for a whole run.
+# Appending through a fresh open() per sensor and file costs an open, a stat
+# and a close for every sensor of every Avro file, which dominates on network
+# filesystems. The writer set below opens each output file once, on its first
+# write, behind a large buffer. Buffers are flushed when they fill up, when
+# FLUSH_INTERVAL seconds have passed since the last flush, on flush_writers()
+# and when the set is closed.
+#
+# A writer set is a plain dict: open_writers() creates it and csv_writers()
+# wraps it in a context manager that closes every file on exit. Callables in
+# writers['on_flush'] run after each flush, so state kept next to the CSVs
+# can be saved together with the rows it describes.
+#
+# Rows are formatted into a block of text and written in one call, and the
+# writer set counts the bytes written to each file (writers['offsets']).
+# Offsets are never taken from f.tell(), which flushes a text file's buffer
+# and would turn every block into a write system call.
+
+# Write buffer of each open CSV file
+BUFFER_SIZE = 4 << 20
+
+# Longest time rows may sit in a buffer while files keep being written
+FLUSH_INTERVAL = 30.0
+
+
+def open_writers(output_dir, buffer_size=BUFFER_SIZE, flush_interval=FLUSH_INTERVAL):
+    """Create an empty writer set for the CSV files of `output_dir`."""
+    return {
+        'output_dir': output_dir,
+        'buffer_size': buffer_size,
+        'flush_interval': flush_interval,
+        'files': {},
+        'offsets': {},
+        'on_flush': [],
+        'last_flush': time.monotonic(),
+    }
+
+
+def format_rows(rows):
+    """CSV text of rows, formatted as csv.writer writes them."""
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    return text.getvalue()
+
+
+def open_output(writers, filename, header):
+    """Open an output file of a writer set on first use; returns its byte size.
+
+    The header is written when the file is empty, which the append-mode
+    position tells without a separate exists() check. A non-empty file must
+    already have the same header, so rows of another layout (such as another
+    output mode) are never appended under it.
+    """
+    if filename not in writers['files']:
+        path = os.path.join(writers['output_dir'], filename)
+        f = open(path, 'a', newline='', buffering=writers['buffer_size'])
+        writers['files'][filename] = f
+        # Nothing is buffered yet, so this tell() does not write anything
+        writers['offsets'][filename] = f.tell()
+        if writers['offsets'][filename] == 0:
+            write_text(writers, filename, format_rows([header]))
+        else:
+            with open(path, newline='') as existing:
+                current = next(csv.reader(existing), None)
+            if current != [str(column) for column in header]:
+                f.close()
+                del writers['files'][filename], writers['offsets'][filename]
+                raise ValueError(f"{path} has the columns {current}, not {list(header)}; "
+                                 f"write this output to another folder.")
+    return writers['offsets'][filename]
+
+
+def write_text(writers, filename, text):
+    """Append text to an open output file; returns the file's new byte size."""
+    f = writers['files'][filename]
+    f.write(text)
+    writers['offsets'][filename] += len(text.encode(f.encoding))
+    return writers['offsets'][filename]
+
+
+def write_rows(writers, filename, header, rows):
+    """Append rows to an output file, flushing every file once the interval has passed."""
+    open_output(writers, filename, header)
+    write_text(writers, filename, format_rows(rows))
+    maybe_flush(writers)
+
+
+def maybe_flush(writers):
+    """Flush every file if FLUSH_INTERVAL has passed since the last flush."""
+    if time.monotonic() - writers['last_flush'] >= writers['flush_interval']:
+        flush_writers(writers)
+
+
+def flush_writers(writers):
+    """Hand every buffered row to the OS, then run the on_flush callbacks."""
+    with stage('flush'):
+        for f in writers['files'].values():
+            f.flush()
+        for callback in writers['on_flush']:
+            callback()
+    writers['last_flush'] = time.monotonic()
+
+
+def close_writers(writers):
+    """Flush and close every open file."""
+    flush_writers(writers)
+    for f in writers['files'].values():
+        f.close()
+    writers['files'].clear()
+    writers['offsets'].clear()
+
+
+def file_sizes(writers, filenames):
+    """Current size of each output file, counting rows still in its buffer.
+
+    Keyed by path; None for files that do not exist yet.
+    """
+    sizes = {}
+    for filename in filenames:
+        path = os.path.join(writers['output_dir'], filename)
+        if filename in writers['offsets']:
+            sizes[path] = writers['offsets'][filename]
+        else:
+            sizes[path] = os.path.getsize(path) if os.path.exists(path) else None
+    return sizes
+
+
+@contextlib.contextmanager
+def csv_writers(output_dir, buffer_size=BUFFER_SIZE, flush_interval=FLUSH_INTERVAL):
+    """Context manager around open_writers() that closes every file on exit."""
+    writers = open_writers(output_dir, buffer_size, flush_interval)
+    try:
+        yield writers
+    finally:
+        close_writers(writers)
@@ -0,0 +1,252 @@
+import json
+import os
+import numpy as np
+from avro_stream import iter_records
+from interval_index import record_intervals
+from output_modes import apply_output_modes
+from pipeline_metrics import count_rows, stage
+from processed_manifest import file_identity, file_sha256
+from sensor_decode import decode_raw_data, imu_deltas
+
+## Binary cache of decoded Avro files.
+# Decoding an Avro file costs far more than reading the same samples back as
+# binary arrays, so every file decoded with a cache is also stored in it:
+#   <cache_dir>/<sha256 of the Avro file>.bin   column arrays, 64-byte aligned
+#   <cache_dir>/<sha256 of the Avro file>.json  sensor metadata and layout
+# A rerun of a converter, a conversion to another output format or an
+# analysis reads the columns back with np.memmap instead of the Avro reader.
+# The key is the file content, so renamed or re-synced copies hit the cache
+# and a changed file never does. The hash is taken with file_identity() and
+# handed back to the caller, so the manifest does not read the file again.
+#
+# The stored arrays are compact but lossless, so cached and fresh decodes
+# give bit-identical outputs:
+#   int64    timestamps and events, memory-mapped as they are (zero copy)
+#   float32  sensor values, which Avro stores as 32-bit floats
+#   int32    accelerometer/gyroscope ADC counts, scaled back to physical
+#            units on load exactly as decode_imu() does
+# Any column that would not round-trip is kept at its decoded dtype. Each
+# record also keeps the samplingFrequency, timestampStart and imuParams of
+# its sensors. Reading an entry refreshes its .json mtime; once the cache
+# grows past max_bytes the least recently read entries are deleted.
+#
+# Entries always hold the full-resolution columns; reduced output modes are
+# applied to them as they are read.
+
+CACHE_VERSION = 1
+MAX_CACHE_BYTES = 20 << 30
+ALIGNMENT = 64
+
+# rawData fields kept as the metadata of each sensor of a record
+SENSOR_METADATA = ("timestampStart", "samplingFrequency", "imuParams")
+
+
+def open_decoded_cache(cache_dir, max_bytes=MAX_CACHE_BYTES):
+    """Describe a decoded-file cache; a plain dict, so it can be passed to pool workers."""
+    os.makedirs(cache_dir, exist_ok=True)
+    return {'dir': cache_dir, 'max_bytes': max_bytes}
+
+
+def entry_paths(cache, key):
+    """(.bin, .json) paths of a cache entry."""
+    stem = os.path.join(cache['dir'], key)
+    return stem + '.bin', stem + '.json'
+
+
+def decode_column(stored, info):
+    """Turn a stored column back into the array decode_raw_data() returns."""
+    if info.get('scale'):
+        # Same operations, in the same order, as decode_imu()
+        values = stored.astype(np.float64)
+        values *= info['scale'][0]
+        values /= info['scale'][1]
+        return values
+    if stored.dtype != np.dtype(info['decoded']):
+        return stored.astype(info['decoded'])
+    return stored
+
+
+def encode_column(column, scale=None):
+    """Smallest stored form of a decoded column that decodes back to it exactly.
+
+    Returns (array to store, column info). `scale` is the (delta_physical,
+    delta_digital) of an IMU sensor.
+    """
+    info = {'decoded': column.dtype.str}
+    if column.dtype.kind != 'f':
+        return column, info
+    if scale is not None and len(column):
+        counts = np.rint(column * scale[1] / scale[0])
+        if np.abs(counts).max() < 2 ** 31:
+            counts = counts.astype(np.int32)
+            scaled = dict(info, scale=list(scale))
+            if np.array_equal(decode_column(counts, scaled), column):
+                return counts, scaled
+    narrow = column.astype(np.float32)
+    if np.array_equal(narrow.astype(column.dtype), column, equal_nan=True):
+        return narrow, info
+    return column, info
+
+
+def write_column(f, array):
+    """Append an array to the .bin file at the next aligned offset; returns its layout."""
+    offset = -(-f.tell() // ALIGNMENT) * ALIGNMENT
+    f.write(b'\0' * (offset - f.tell()))
+    array = np.ascontiguousarray(array)
+    f.write(array.tobytes())
+    return {'offset': offset, 'dtype': array.dtype.str, 'length': len(array)}
+
+
+def iter_decode_and_store(avro_file_path, cache, key, reader=None):
+    """Decode an Avro file like iter_sensor_chunks() and store it in the cache.
+
+    The columns are written as each record is decoded; the entry only
+    becomes visible once the whole file has been read. Yields the decoded
+    sensors of each record with their metadata.
+    """
+    bin_path, json_path = entry_paths(cache, key)
+    tmp_path = f"{bin_path}.{os.getpid()}.tmp"
+    records = []
+    try:
+        with open(tmp_path, 'wb') as f:
+            for record in iter_records(avro_file_path, reader):
+                raw_data = record["rawData"]
+                sensors = decode_raw_data(raw_data)
+                layout = {}
+                for name, columns in sensors.items():
+                    raw = raw_data[name]
+                    scale = imu_deltas(raw) if "imuParams" in raw else None
+                    stored = {}
+                    for column, values in columns.items():
+                        array, info = encode_column(values, scale)
+                        stored[column] = dict(info, **write_column(f, array))
+                    layout[name] = {
+                        'metadata': {field: raw[field] for field in SENSOR_METADATA
+                                     if field in raw},
+                        'columns': stored,
+                    }
+                records.append(layout)
+                yield sensors, {name: sensor['metadata'] for name, sensor in layout.items()}
+        os.replace(tmp_path, bin_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    tmp_json = f"{json_path}.{os.getpid()}.tmp"
+    with open(tmp_json, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'source': os.path.basename(avro_file_path),
+                   'records': records}, f)
+    os.replace(tmp_json, json_path)
+    evict(cache)
+
+
+def read_entry(cache, key):
+    """Memory-map a cache entry, or return None when it is missing or stale.
+
+    Returns one dict per Avro record: sensor -> {'metadata': {...},
+    'columns': {column: (stored array, column info)}}. The stored arrays are
+    read-only memmaps of the .bin file.
+    """
+    bin_path, json_path = entry_paths(cache, key)
+    try:
+        with open(json_path) as f:
+            entry = json.load(f)
+        size = os.path.getsize(bin_path)
+    except (FileNotFoundError, ValueError):
+        return None
+    if entry.get('version') != CACHE_VERSION:
+        return None
+    os.utime(json_path)
+    records = []
+    for layout in entry['records']:
+        record = {}
+        for name, sensor in layout.items():
+            columns = {}
+            for column, info in sensor['columns'].items():
+                dtype = np.dtype(info['dtype'])
+                if info['length'] == 0 or size == 0:
+                    stored = np.empty(0, dtype)
+                else:
+                    stored = np.memmap(bin_path, dtype=dtype, mode='r', offset=info['offset'],
+                                       shape=(info['length'],))
+                columns[column] = (stored, info)
+            record[name] = {'metadata': sensor['metadata'], 'columns': columns}
+        records.append(record)
+    return records
+
+
+def decode_entry_record(record):
+    """Decoded sensors of one cached record, as decode_raw_data() returns them."""
+    return {name: {column: decode_column(stored, info)
+                   for column, (stored, info) in sensor['columns'].items()}
+            for name, sensor in record.items()}
+
+
+def iter_cached_sensor_chunks(avro_file_path, cache, reader=None, output_modes=None,
+                              intervals=None, identity=None):
+    """Yield the decoded sensors of each record, from the cache when the file is in it.
+
+    Takes the same output_modes and intervals as iter_sensor_chunks(). The
+    file_identity() the cache key comes from is added to the `identity` dict,
+    before the first record is read.
+    """
+    found = file_identity(avro_file_path)
+    if identity is not None:
+        identity.update(found)
+    key = found['sha256']
+    records = read_entry(cache, key)
+    if records is None:
+        chunks = iter_decode_and_store(avro_file_path, cache, key, reader)
+    else:
+        chunks = cached_chunks(records)
+    for sensors, metadata in chunks:
+        if intervals is not None:
+            intervals.append(record_intervals(sensors, metadata))
+        if output_modes:
+            with stage('output_modes'):
+                sensors = apply_output_modes(sensors, metadata, output_modes)
+        yield sensors
+
+
+def cached_chunks(records):
+    """(decoded sensors, metadata) of each record read from the cache."""
+    for record in records:
+        with stage('decoded_cache') as counts:
+            sensors = decode_entry_record(record)
+            counts['rows'] = count_rows(sensors)
+        yield sensors, {name: sensor['metadata'] for name, sensor in record.items()}
+
+
+def load_decoded(avro_file_path, cache, reader=None):
+    """Memory-mapped records of an Avro file (see read_entry), decoding it on a miss."""
+    key = file_sha256(avro_file_path)
+    records = read_entry(cache, key)
+    if records is None:
+        for _ in iter_decode_and_store(avro_file_path, cache, key, reader):
+            pass
+        records = read_entry(cache, key)
+    return records
+
+
+def evict(cache):
+    """Delete the least recently read entries until the cache fits in max_bytes."""
+    entries = {}
+    with os.scandir(cache['dir']) as scan:
+        for item in scan:
+            key, ext = os.path.splitext(item.name)
+            if ext not in ('.bin', '.json'):
+                continue
+            stat = item.stat()
+            size, last_used = entries.get(key, (0, 0))
+            last_used = stat.st_mtime if ext == '.json' else last_used
+            entries[key] = (size + stat.st_size, last_used)
+    total = sum(size for size, _ in entries.values())
+    for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+        if total <= cache['max_bytes']:
+            break
+        for path in entry_paths(cache, key)[::-1]:
+            try:
+                os.remove(path)
+            except OSError:
+                # Missing, or still mapped by a reader on Windows
+                pass
+        total -= size
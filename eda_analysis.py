@@ -0,0 +1,301 @@
+import argparse
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import signal
+from output_backends import OUTPUT_FORMATS, import_pyarrow, sensor_name
+from parallel_ingest import ordered_map
+from sensor_decode import timestamp_rate
+
+## Out-of-core SCR peak detection over a converted eda.csv.
+# The EDA scripts load the whole of eda.csv and filter it as one series, so
+# participants and recording gaps run into each other and large studies do
+# not fit in memory. Here the file, or the eda/ folder of a parquet/feather
+# output, is streamed in chunks and every participant's rows are cut into
+# contiguous segments, split wherever two samples are more than MAX_GAP_S
+# apart or go back in time.
+#
+# Each segment is analysed in windows of CHUNK_S seconds. A window is filtered
+# together with MARGIN_S seconds of the samples on either side, and only the
+# peaks that fall inside the window itself are kept, so a peak on a window
+# edge is found once, with the same context as in an unchunked run. Only one
+# window (plus margins) per participant is held in memory. Windows are
+# independent and are analysed in a process pool with --workers N.
+#
+# The sampling rate is not fixed: each segment's is recovered from the median
+# step of its first RATE_SAMPLES timestamps (sensor_decode.timestamp_rate(),
+# as in sensor_features), and sizes its windows, filter and peak distances.
+# Estimating it from a fixed number of samples keeps it independent of how
+# the input is chunked. --sampling-rate forces one rate for every segment.
+#
+# The filter is the 2nd order Butterworth bandpass of eda_scr_peak.py
+# (biobss.filter_signal is a wrapper around scipy's sosfiltfilt), and peaks
+# are scipy.signal.find_peaks maxima of the filtered (phasic) signal. A
+# peak's amplitude is its prominence within PROMINENCE_WINDOW_S around it,
+# never more than the margins: measured out to the window edges, it would
+# depend on where the windows are cut, and so would the peaks kept by the
+# MIN_AMPLITUDE threshold.
+
+CHUNK_S = 60 * 60
+MARGIN_S = 60
+MAX_GAP_S = 1.0
+
+# Samples at the start of a segment its sampling rate is estimated from
+RATE_SAMPLES = 64
+
+# eda_scr_peak.py bandpass
+FILTER_ORDER = 2
+F_LOWER = 0.05
+F_UPPER = 0.5
+
+# Smallest SCR amplitude (peak prominence, µS) and time between SCR peaks (s)
+MIN_AMPLITUDE = 0.01
+MIN_PEAK_DISTANCE_S = 1.0
+
+# Span around a peak its prominence (amplitude) is measured in (s)
+PROMINENCE_WINDOW_S = 20.0
+
+PEAK_COLUMNS = ["participant_id", "segment", "peak_timestamp", "amplitude", "eda"]
+
+
+def iter_eda_chunks(eda_csv_path, chunksize=1_000_000):
+    """Stream (participant_id, timestamps, eda) blocks from a converted eda.csv.
+
+    Consecutive rows of a participant within a pandas chunk form one block, so
+    blocks arrive in file order.
+    """
+    for chunk in pd.read_csv(eda_csv_path, dtype={"participant_id": str},
+                             usecols=["participant_id", "unix_timestamp", "eda"],
+                             chunksize=chunksize):
+        participants = chunk["participant_id"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, participants[1:] != participants[:-1]])
+        stops = np.r_[starts[1:], len(chunk)]
+        timestamps = chunk["unix_timestamp"].to_numpy(np.int64)
+        values = chunk["eda"].to_numpy(np.float64)
+        for start, stop in zip(starts, stops):
+            yield participants[start], timestamps[start:stop], values[start:stop]
+
+
+def iter_eda_partitioned(output_dir, output_format="parquet"):
+    """Stream (participant_id, timestamps, eda) blocks from a parquet/feather output folder.
+
+    Part files are read one record batch at a time, in participant, date and
+    file name order.
+    """
+    pa = import_pyarrow()
+    import pyarrow.dataset as ds
+    partitioning = ds.partitioning(
+        pa.schema([("participant_id", pa.string()), ("date", pa.string())]), flavor="hive")
+    dataset = ds.dataset(os.path.join(output_dir, sensor_name("eda")),
+                         format="ipc" if output_format == "feather" else "parquet",
+                         partitioning=partitioning)
+    for fragment in sorted(dataset.get_fragments(), key=lambda fragment: fragment.path):
+        participant_id = ds.get_partition_keys(fragment.partition_expression)["participant_id"]
+        for batch in fragment.to_batches(columns=["unix_timestamp", "eda"]):
+            yield (participant_id, batch.column(0).to_numpy().astype(np.int64),
+                   batch.column(1).to_numpy().astype(np.float64))
+
+
+def iter_eda_blocks(source, output_format="parquet"):
+    """Stream EDA blocks from an eda.csv file or a columnar output folder."""
+    if os.path.isdir(source):
+        return iter_eda_partitioned(source, output_format)
+    return iter_eda_chunks(source)
+
+
+def iter_eda_windows(blocks, sampling_rate=None, chunk_s=CHUNK_S, margin_s=MARGIN_S,
+                     max_gap_s=MAX_GAP_S):
+    """Cut streamed EDA blocks into analysis windows with margins.
+
+    Yields (participant_id, segment, rate, timestamps, values, core_start,
+    core_stop): peaks are reported for samples [core_start, core_stop) of the
+    arrays only, the rest is filter context. Every sample is in the core of
+    exactly one window. Segments are numbered per participant in order of
+    appearance. `rate` is the segment's sampling rate, `sampling_rate` when
+    given, and None for a segment of a single sample.
+    """
+    max_gap_us = max_gap_s * 1e6
+    # participant -> buffered samples of its current segment
+    segments = {}
+
+    def cut(participant_id, final):
+        """Yield the windows of a segment buffer that have their right margin."""
+        seg = segments[participant_id]
+        timestamps, values, core_start = seg["timestamps"], seg["values"], seg["core_start"]
+        if "rate" not in seg:
+            if len(timestamps) < RATE_SAMPLES and not final:
+                return
+            seg["rate"] = sampling_rate or timestamp_rate(timestamps[:RATE_SAMPLES])
+        rate = seg["rate"]
+        chunk = max(int(chunk_s * rate), 1) if rate else len(timestamps)
+        margin = int(margin_s * rate) if rate else 0
+        while (len(timestamps) - core_start >= chunk + margin
+               or (final and core_start < len(timestamps))):
+            core_stop = min(core_start + chunk, len(timestamps))
+            stop = min(core_stop + margin, len(timestamps))
+            yield (participant_id, seg["segment"], rate, timestamps[:stop], values[:stop],
+                   core_start, core_stop)
+            # Keep the left margin of the next window
+            drop = max(core_stop - margin, 0)
+            timestamps, values = timestamps[drop:], values[drop:]
+            core_start = core_stop - drop
+        seg.update(timestamps=timestamps, values=values, core_start=core_start)
+
+    def is_break(steps):
+        return (steps <= 0) | (steps > max_gap_us)
+
+    for participant_id, timestamps, values in blocks:
+        seg = segments.get(participant_id)
+        starts = np.flatnonzero(is_break(np.diff(timestamps))) + 1
+        continues = seg is not None and not is_break(timestamps[0] - seg["last"])
+        for i, (start, stop) in enumerate(zip(np.r_[0, starts], np.r_[starts, len(timestamps)])):
+            if i == 0 and continues:
+                seg["timestamps"] = np.concatenate([seg["timestamps"], timestamps[start:stop]])
+                seg["values"] = np.concatenate([seg["values"], values[start:stop]])
+            else:
+                if seg is not None:
+                    yield from cut(participant_id, final=True)
+                seg = segments[participant_id] = {
+                    "segment": 0 if seg is None else seg["segment"] + 1,
+                    "timestamps": timestamps[start:stop], "values": values[start:stop],
+                    "core_start": 0}
+            seg["last"] = timestamps[stop - 1]
+            yield from cut(participant_id, final=False)
+    for participant_id in segments:
+        yield from cut(participant_id, final=True)
+
+
+def bandpass(values, sampling_rate, order=FILTER_ORDER, f_lower=F_LOWER, f_upper=F_UPPER):
+    """Zero-phase Butterworth bandpass, as biobss.filter_signal(filter_type='bandpass')."""
+    sos = signal.butter(order, [f_lower / (sampling_rate / 2), f_upper / (sampling_rate / 2)],
+                        "bandpass", output="sos")
+    # sosfiltfilt needs a few samples more than its padding
+    padlen = min(3 * (2 * len(sos) + 1), len(values) - 1)
+    if padlen < 1:
+        return values - values.mean()
+    return signal.sosfiltfilt(sos, values, padlen=padlen)
+
+
+def prominence_window(sampling_rate, margin_s=MARGIN_S, window_s=PROMINENCE_WINDOW_S):
+    """find_peaks wlen in samples: odd, and at most the two margins of a window."""
+    wlen = int(min(window_s, 2 * margin_s) * sampling_rate)
+    return max(wlen - (1 - wlen % 2), 3)
+
+
+def detect_peaks(filtered, sampling_rate, min_amplitude=MIN_AMPLITUDE,
+                 min_peak_distance_s=MIN_PEAK_DISTANCE_S, margin_s=MARGIN_S):
+    """SCR peaks of a phasic signal: (indices, amplitudes)."""
+    distance = max(int(min_peak_distance_s * sampling_rate), 1)
+    peaks, properties = signal.find_peaks(filtered, prominence=min_amplitude, distance=distance,
+                                          wlen=prominence_window(sampling_rate, margin_s))
+    return peaks, properties["prominences"]
+
+
+def analyze_window(window, min_amplitude=MIN_AMPLITUDE, min_peak_distance_s=MIN_PEAK_DISTANCE_S,
+                   margin_s=MARGIN_S):
+    """Detect SCR peaks in the core of one window; returns the rows of the peak table."""
+    participant_id, segment, rate, timestamps, values, core_start, core_stop = window
+    if rate is None:
+        # A single sample has no rate and no peaks
+        peaks = amplitudes = np.empty(0, dtype=np.int64)
+    else:
+        peaks, amplitudes = detect_peaks(bandpass(values, rate), rate, min_amplitude,
+                                         min_peak_distance_s, margin_s)
+    in_core = (peaks >= core_start) & (peaks < core_stop)
+    peaks = peaks[in_core]
+    return {
+        "participant_id": participant_id,
+        "segment": segment,
+        "sampling_rate": rate,
+        "first": int(timestamps[core_start]),
+        "last": int(timestamps[core_stop - 1]),
+        "samples": core_stop - core_start,
+        "eda_sum": float(values[core_start:core_stop].sum()),
+        "peaks": list(zip(timestamps[peaks].tolist(),
+                          amplitudes[in_core].tolist(),
+                          values[peaks].tolist())),
+    }
+
+
+def scr_peaks(source, workers=1, sampling_rate=None, chunk_s=CHUNK_S,
+              margin_s=MARGIN_S, max_gap_s=MAX_GAP_S, min_amplitude=MIN_AMPLITUDE,
+              output_format="parquet"):
+    """Detect SCR peaks in every participant and segment of an eda.csv.
+
+    `source` is an eda.csv file or the output folder of a parquet/feather run
+    (`output_format` tells which). Each segment's sampling rate is estimated
+    from its timestamps unless `sampling_rate` is given.
+
+    Returns (peaks, segments): one row per SCR peak, and one row per
+    participant segment with its sampling rate, time span, mean EDA and SCR
+    rate.
+    """
+    windows = iter_eda_windows(iter_eda_blocks(source, output_format), sampling_rate, chunk_s,
+                               margin_s, max_gap_s)
+    analyze = functools.partial(analyze_window, min_amplitude=min_amplitude, margin_s=margin_s)
+    peak_rows = []
+    segments = {}
+
+    def collect(result):
+        key = (result["participant_id"], result["segment"])
+        seg = segments.setdefault(key, {"participant_id": key[0], "segment": key[1],
+                                        "sampling_rate": result["sampling_rate"],
+                                        "first": result["first"], "samples": 0,
+                                        "eda_sum": 0.0, "peaks": 0})
+        seg["last"] = result["last"]
+        seg["samples"] += result["samples"]
+        seg["eda_sum"] += result["eda_sum"]
+        seg["peaks"] += len(result["peaks"])
+        peak_rows.extend((key[0], key[1], *peak) for peak in result["peaks"])
+
+    if workers <= 1:
+        for window in windows:
+            collect(analyze(window))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for _, result in ordered_map(executor, analyze, windows, 2 * workers):
+                collect(result)
+
+    peaks = pd.DataFrame(peak_rows, columns=PEAK_COLUMNS).sort_values(
+        ["participant_id", "segment", "peak_timestamp"], ignore_index=True)
+    segments = pd.DataFrame(list(segments.values()),
+                            columns=["participant_id", "segment", "sampling_rate", "first",
+                                     "last", "samples", "eda_sum", "peaks"]).sort_values(
+        ["participant_id", "segment"], ignore_index=True)
+    segments["mean_eda"] = segments["eda_sum"] / segments["samples"]
+    # The last sample covers one period; a single-sample segment has no rate (NaN)
+    period_s = 1 / segments["sampling_rate"].astype(float)
+    minutes = (segments["last"] - segments["first"]) / 60e6 + period_s / 60
+    segments["scr_per_minute"] = segments["peaks"] / minutes
+    return peaks, segments.drop(columns="eda_sum")
+
+
+if __name__ == "__main__":
+    # Example usage: python eda_analysis.py Output4/eda.csv --workers 4
+    parser = argparse.ArgumentParser(description="Detect SCR peaks per participant in eda.csv.")
+    parser.add_argument("source", help="eda.csv, or the output folder of a parquet run")
+    parser.add_argument("output_dir", nargs="?", default=None,
+                        help="where to write scr_peaks.csv and eda_segments.csv "
+                             "(default: next to eda.csv, or the parquet output folder)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes analysing windows in parallel")
+    parser.add_argument("--format", dest="output_format", default="parquet",
+                        choices=sorted(OUTPUT_FORMATS),
+                        help="format of the part files when source is a folder")
+    parser.add_argument("--sampling-rate", type=float, default=None,
+                        help="EDA sampling rate (Hz) of every segment (default: estimated "
+                             "from the timestamps of each segment)")
+    parser.add_argument("--chunk", type=float, default=CHUNK_S, help="window length (s)")
+    parser.add_argument("--margin", type=float, default=MARGIN_S,
+                        help="filter context on each side of a window (s)")
+    args = parser.parse_args()
+    output_dir = args.output_dir or (args.source if os.path.isdir(args.source)
+                                     else os.path.dirname(os.path.abspath(args.source)))
+    peaks, segments = scr_peaks(args.source, workers=args.workers,
+                                sampling_rate=args.sampling_rate, chunk_s=args.chunk,
+                                margin_s=args.margin, output_format=args.output_format)
+    peaks.to_csv(os.path.join(output_dir, "scr_peaks.csv"), index=False)
+    segments.to_csv(os.path.join(output_dir, "eda_segments.csv"), index=False)
+    print(segments.groupby("participant_id")[["samples", "peaks"]].sum())
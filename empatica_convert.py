@@ -0,0 +1,419 @@
+import argparse
+import functools
+import glob
+import os
+import numpy as np
+from avro_stream import AVRO_READERS, iter_sensor_chunks
+from csv_writers import csv_writers, flush_writers, file_sizes
+from decoded_cache import MAX_CACHE_BYTES, open_decoded_cache
+from interval_index import (add_file_intervals, build_interval_index, covered_seconds,
+                            group_intervals)
+from output_backends import OUTPUT_FORMATS, partition_values, write_partitioned
+from output_modes import parse_output_modes
+from parallel_ingest import avro_sort_key, iter_decoded_files
+from pipeline_metrics import run_instrumented, stage, timed
+from processed_manifest import (MANIFEST_FILE, load_manifest, find_processed, begin_file,
+                                cancel_file, commit_file, file_identity, rollback_pending,
+                                update_sensor_stats, import_path_log)
+from sensor_decode import SENSOR_FILES
+from sensor_query import merge_ranges, offset_index_name, offset_ranges, write_indexed_rows
+
+## Conversion of Empatica Avro files to per-sensor CSV or columnar files.
+# The one implementation behind avro_to_csv.py, avro_to_csv_with_ID.py and
+# avro_to_csv_example_script.py, which are now thin entry points into it.
+# Two switches cover their differences:
+#   participant_ids - lead every CSV row with the participant ID taken from
+#                     the file name, and skip rows already written for that
+#                     participant (offset index); otherwise rows are appended
+#                     as they come, as avro_to_csv.py did
+#   incremental     - skip files recorded in the processed-file manifest and
+#                     commit each file to it once written
+# and output_modes ({sensor: mode}, see output_modes.py) reduces sensors to
+# decimated, windowed, rounded or ADC-count rows instead of writing every
+# sample at full precision.
+# Importing the module does no work and pulls in neither pandas nor pyarrow;
+# they are loaded only by the code paths that need them, so short runs and
+# pool workers start quickly.
+#
+# Example: python empatica_convert.py C:/Data/Empatica C:/Data/Output --workers 4
+
+# Files repeating at least this many seconds of already converted data are reported
+OVERLAP_REPORT_S = 1.0
+
+
+def open_manifest(output_dir, manifest_path=None, import_log=None):
+    """Load the processed-file manifest, recovering from an interrupted run.
+
+    CSV files and offset indexes written by a file that was never committed
+    are truncated back. With import_log, the files listed in a processed_files.txt written by
+    earlier versions are recorded as converted first. The folder of the
+    manifest is created when it does not exist yet.
+    """
+    if manifest_path is None:
+        manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    manifest = load_manifest(manifest_path)
+    if import_log:
+        if not os.path.exists(import_log):
+            raise FileNotFoundError(f"Path log {import_log} does not exist.")
+        print(f"Imported {import_path_log(manifest, import_log)} processed files "
+              f"from {import_log}")
+    for output in rollback_pending(manifest):
+        print(f"Rolled back interrupted writes to {output}")
+    return manifest
+
+
+def in_ranges(timestamps, ranges):
+    """Mask of the timestamps that fall inside one of the sorted, merged ranges."""
+    if not ranges:
+        return np.zeros(len(timestamps), dtype=bool)
+    bounds = np.asarray(ranges, dtype=np.int64)
+    i = np.searchsorted(bounds[:, 0], timestamps, side='right') - 1
+    return (i >= 0) & (timestamps <= bounds[np.maximum(i, 0), 1])
+
+
+def written_ranges(writers, file_path):
+    """participant_id -> [[first, last], ...] already in a CSV file of a writer set.
+
+    Read from the offset index on the first call of a run and kept up to
+    date as rows are written; the offset index itself is the durable copy.
+    """
+    ranges = writers.setdefault('ranges', {})
+    if file_path not in ranges:
+        ranges[file_path] = offset_ranges(file_path)
+    return ranges[file_path]
+
+
+def append_to_csv(filename, columns, output_dir, participant_id=None, timestamp_col=None,
+                  writers=None):
+    """Append decoded sensor columns to a CSV file.
+
+    With a participant_id the rows are led by it, and rows that fall inside a
+    range already written for the participant are dropped. Those ranges are
+    the (participant_id, first, last) blocks of the CSV's offset index, read
+    once per run, so the cost is O(new rows). Without one the rows are
+    appended as they are.
+
+    Rows go through `writers`, a writer set kept open across calls; without
+    one the file is opened for this call only. Their byte offsets are added
+    to the offset index used by sensor_query.load().
+    """
+    if writers is None:
+        with csv_writers(output_dir) as writers:
+            append_to_csv(filename, columns, output_dir, participant_id, timestamp_col, writers)
+        return
+    if participant_id is None:
+        write_indexed_rows(writers, filename, list(columns), columns)
+        return
+    timestamp_col = timestamp_col or next(iter(columns))
+    timestamps = columns[timestamp_col]
+    if len(timestamps) == 0:
+        return
+    index = written_ranges(writers, os.path.join(output_dir, filename))
+    ranges = index.get(participant_id, [])
+
+    with stage('dedup', rows=len(timestamps)):
+        keep = ~in_ranges(timestamps, ranges)
+    if not keep.any():
+        print(f"Skipping {filename}: rows already written.")
+        return
+    if not keep.all():
+        columns = {name: col[keep] for name, col in columns.items()}
+        timestamps = columns[timestamp_col]
+
+    entries = write_indexed_rows(writers, filename, ['participant_id'] + list(columns), columns,
+                                 participant_id)
+    index[participant_id] = merge_ranges(ranges + [entry[1:3] for entry in entries])
+
+
+def extract_participant_id(avro_file_path):
+    """Extract participant ID from Avro file name."""
+    file_name = os.path.basename(avro_file_path)
+    participant_id = file_name.split('_')[0]
+    return participant_id
+
+
+@timed
+def write_sensors(avro_file_path, sensors, output_dir, output_format='csv', chunk=0,
+                  writers=None, participant_ids=True):
+    """Append every decoded sensor to its CSV file, or write its columnar part file."""
+    participant_id = extract_participant_id(avro_file_path)
+    if output_format != 'csv':
+        _, date = partition_values(avro_file_path, sensors, participant_id)
+    for name, columns in sensors.items():
+        if output_format == 'csv':
+            append_to_csv(SENSOR_FILES[name], columns, output_dir,
+                          participant_id if participant_ids else None, writers=writers)
+        else:
+            write_partitioned(output_dir, name, columns, avro_file_path,
+                              participant_id=participant_id, output_format=output_format,
+                              chunk=chunk, date=date)
+
+
+@timed
+def process_avro_file(avro_file_path, output_dir, output_format='csv', reader=None,
+                      participant_ids=True, output_modes=None):
+    """Process every record of a single Avro file and append to CSV files."""
+    output_modes = parse_output_modes(output_modes)
+    with csv_writers(output_dir) as writers:
+        for chunk, sensors in enumerate(iter_sensor_chunks(avro_file_path, reader,
+                                                           output_modes)):
+            write_sensors(avro_file_path, sensors, output_dir, output_format, chunk, writers,
+                          participant_ids)
+
+
+def report_overlap(index, avro_file_path, intervals):
+    """Print which sensors of a file cover time already in the interval index."""
+    participant_id = extract_participant_id(avro_file_path)
+    repeated = {}
+    for name, spans in intervals.items():
+        seconds = sum(covered_seconds(index, participant_id, name, start, end)
+                      for start, end in spans)
+        if seconds >= OVERLAP_REPORT_S:
+            repeated[name] = seconds
+    if repeated:
+        details = ", ".join(f"{name} {seconds:.0f} s" for name, seconds in repeated.items())
+        print(f"{avro_file_path} overlaps data already converted for {participant_id}: "
+              f"{details}")
+
+
+def remove_csv_outputs(output_dir):
+    """Delete the sensor CSVs of an output folder with their offset indexes."""
+    for filename in SENSOR_FILES.values():
+        path = os.path.join(output_dir, filename)
+        for output in (path, offset_index_name(path)):
+            if os.path.exists(output):
+                os.remove(output)
+
+
+def find_avro_files(source):
+    """The Avro files of a folder (recursively), or a single file, in processing order."""
+    if os.path.isfile(source):
+        return [source]
+    return sorted(glob.glob(os.path.join(source, '**', '*.avro'), recursive=True),
+                  key=avro_sort_key)
+
+
+def unprocessed_files(manifest, avro_files):
+    """The files not in the manifest yet, leaving out those removed since they were found."""
+    new_files = []
+    for avro_file in avro_files:
+        try:
+            if find_processed(manifest, avro_file) is None:
+                new_files.append(avro_file)
+            else:
+                print(f"Skipping already processed file: {avro_file}")
+        except FileNotFoundError:
+            print(f"Skipping {avro_file}: it was removed before it was ingested.")
+    return new_files
+
+
+def ingest_files(avro_files, output_dir, manifest, writers, workers=1, output_format='csv',
+                 reader=None, decoded_cache=None, participant_ids=True, output_modes=None):
+    """Decode, write and commit the given Avro files in order through an open writer set.
+
+    With manifest=None the files are written without being recorded.
+    Otherwise the [start, end) of every record is committed with its file,
+    and files covering time already converted for their participant are
+    reported. Files removed before they could be read are skipped.
+    """
+    output_modes = parse_output_modes(output_modes)
+    index = build_interval_index(manifest) if manifest is not None else None
+    # Part files are replaced, not appended to, so there is nothing to roll back
+    output_files = []
+    if output_format == 'csv':
+        for filename in SENSOR_FILES.values():
+            output_files += [filename, offset_index_name(filename)]
+    for avro_file, chunks, intervals, identity in iter_decoded_files(
+            avro_files, workers, reader, decoded_cache, output_modes):
+        print(f"Processing {avro_file}...")
+
+        try:
+            # Taken now, as the file may be gone by the time its rows are written.
+            # A decoded cache takes it itself, before reading the first record.
+            if manifest is not None and decoded_cache is None:
+                identity = file_identity(avro_file)
+        except FileNotFoundError:
+            chunks = None
+        if chunks is None:
+            print(f"Skipping {avro_file}: it no longer exists.")
+            continue
+        if manifest is not None:
+            begin_file(manifest, avro_file, file_sizes(writers, output_files))
+        sensor_stats = {}
+        written = 0
+        try:
+            for chunk, sensors in enumerate(chunks):
+                write_sensors(avro_file, sensors, output_dir, output_format, chunk, writers,
+                              participant_ids)
+                update_sensor_stats(sensor_stats, sensors)
+                written += 1
+        except FileNotFoundError as e:
+            # Streamed chunks open the file on the first read, so nothing was written yet
+            if written or e.filename != avro_file:
+                raise
+            if manifest is not None:
+                cancel_file(manifest, avro_file)
+            print(f"Skipping {avro_file}: it no longer exists.")
+            continue
+        if manifest is not None:
+            intervals = group_intervals(intervals)
+            report_overlap(index, avro_file, intervals)
+            # The rows must reach the CSV files before the file is committed
+            flush_writers(writers)
+            commit_file(manifest, avro_file, sensor_stats, intervals, identity)
+            add_file_intervals(index, avro_file, intervals)
+        print(f"Finished processing {avro_file}")
+
+
+def process_folder(folder_path, output_dir, workers=1, output_format='csv', reader=None,
+                   manifest_path=None, decoded_cache=None, participant_ids=True,
+                   incremental=True, output_modes=None, import_log=None, overwrite=False):
+    """Scan the given folder and process all Avro files recursively.
+
+    `folder_path` may also be a single Avro file. Files are handled in
+    (participant, timestampStart) order. With workers > 1 they are decoded in
+    a process pool and written here in that same order. When incremental,
+    files already in the manifest are skipped, and each file is committed to
+    it only after all of its rows are written. With a decoded_cache (see
+    decoded_cache.py), files decoded before are read back from it instead of
+    the Avro reader. output_modes maps sensors to reduced output modes such
+    as {'accelerometer': 'summary:1'}; the others are written raw. import_log
+    is an old processed_files.txt whose files are added to the manifest as
+    already converted. With overwrite, the sensor CSVs already in output_dir
+    are deleted first, so they hold only the rows of this run.
+    """
+    output_modes = parse_output_modes(output_modes)
+    avro_files = find_avro_files(folder_path)
+    os.makedirs(output_dir, exist_ok=True)
+    if overwrite and output_format == 'csv':
+        remove_csv_outputs(output_dir)
+    manifest = open_manifest(output_dir, manifest_path, import_log) if incremental else None
+
+    if not avro_files:
+        print("No Avro files found.")
+        return
+
+    pending_files = unprocessed_files(manifest, avro_files) if manifest is not None \
+        else avro_files
+
+    # Every sensor file is opened once for the whole run
+    with csv_writers(output_dir) as writers:
+        ingest_files(pending_files, output_dir, manifest, writers, workers, output_format, reader,
+                     decoded_cache, participant_ids, output_modes)
+
+
+def build_parser(**defaults):
+    """Command-line options of the converter; `defaults` overrides option defaults."""
+    parser = argparse.ArgumentParser(description="Convert Empatica Avro files to per-sensor "
+                                                 "CSV, parquet or feather files.")
+    parser.add_argument("source", help="folder searched recursively for .avro files, "
+                                       "or a single .avro file")
+    parser.add_argument("output_dir")
+    parser.add_argument("--no-ids", dest="participant_ids", action="store_false",
+                        help="do not lead CSV rows with the participant ID")
+    parser.add_argument("--no-incremental", dest="incremental", action="store_false",
+                        help="convert every file instead of skipping those in the manifest")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes decoding Avro files in parallel")
+    parser.add_argument("--format", dest="output_format", default="csv",
+                        choices=["csv"] + sorted(OUTPUT_FORMATS),
+                        help="csv appends to one file per sensor; parquet/feather write "
+                             "typed part files partitioned by sensor/participant_id/date")
+    parser.add_argument("--reader", choices=sorted(AVRO_READERS), default=None,
+                        help="Avro decoder (default: fastavro when installed, else avro)")
+    parser.add_argument("--manifest", default=None,
+                        help=f"processed-file manifest (default: <output_dir>/{MANIFEST_FILE})")
+    parser.add_argument("--mode", dest="output_modes", action="append", default=[],
+                        metavar="SENSOR=MODE",
+                        help="reduce a sensor's output: decimate:<hz>, summary:<seconds>, "
+                             "precision:<decimals> or counts (IMU ADC counts), comma-separated "
+                             "to combine, e.g. --mode accelerometer=decimate:8,precision:4; "
+                             "may be repeated")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="delete the sensor CSVs in output_dir first instead of appending "
+                             "to them")
+    parser.add_argument("--import-log", default=None, metavar="PATH",
+                        help="mark the files listed in a processed_files.txt of earlier "
+                             "versions as converted")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and convert files as they are synced into source")
+    parser.add_argument("--watcher", choices=["inotify", "poll"], default=None,
+                        help="with --watch: change notification (default: inotify on Linux, "
+                             "else poll)")
+    parser.add_argument("--interval", dest="interval_s", type=float, default=None,
+                        help="with --watch: seconds between polls, and between settle checks")
+    parser.add_argument("--settle", dest="settle_s", type=float, default=None,
+                        help="with --watch: seconds a file must stay unchanged before it is "
+                             "ingested")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="with --watch: settled files waiting to be written before the "
+                             "watcher blocks")
+    parser.add_argument("--decoded-cache", default=None,
+                        help="folder caching decoded Avro files as binary arrays, "
+                             "reused by later runs")
+    parser.add_argument("--decoded-cache-gb", type=float, default=MAX_CACHE_BYTES / 2**30,
+                        help="size of the decoded-file cache before old entries are evicted")
+    parser.add_argument("--metrics", default=None,
+                        help="write a per-stage timing report here (.json, or .csv for the "
+                             "stage table)")
+    parser.add_argument("--profile", default=None, help="write a cProfile dump here")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="add tracemalloc's peak and largest allocations to the report")
+    parser.set_defaults(**defaults)
+    return parser
+
+
+def main(argv=None, **defaults):
+    """Run the converter command line; `defaults` are passed to build_parser()."""
+    parser = build_parser(**defaults)
+    args = parser.parse_args(argv)
+    try:
+        output_modes = parse_output_modes(args.output_modes)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.import_log and not args.incremental:
+        parser.error("--import-log adds to the manifest and cannot be used with --no-incremental")
+    if args.overwrite and args.incremental:
+        parser.error("--overwrite would leave the manifest listing deleted rows; use it with "
+                     "--no-incremental")
+    # Left at None, watch_folder() uses its own defaults
+    watch_options = {name: getattr(args, name) for name in
+                     ("watcher", "interval_s", "settle_s", "queue_size")
+                     if getattr(args, name) is not None}
+    if watch_options and not args.watch:
+        parser.error("--watcher, --interval, --settle and --queue-size only apply with --watch")
+    decoded_cache = None
+    if args.decoded_cache:
+        decoded_cache = open_decoded_cache(args.decoded_cache, int(args.decoded_cache_gb * 2**30))
+    if args.watch:
+        if not args.incremental:
+            parser.error("--watch relies on the manifest and cannot be used with "
+                         "--no-incremental")
+        # watch_ingest imports this module, so it is only loaded when needed
+        from watch_ingest import watch_folder
+        run = functools.partial(watch_folder, args.source, args.output_dir,
+                                workers=args.workers, output_format=args.output_format,
+                                reader=args.reader, manifest_path=args.manifest,
+                                import_log=args.import_log,
+                                decoded_cache=decoded_cache,
+                                participant_ids=args.participant_ids,
+                                output_modes=output_modes, **watch_options)
+    else:
+        run = functools.partial(process_folder, args.source, args.output_dir,
+                                workers=args.workers, output_format=args.output_format,
+                                reader=args.reader, manifest_path=args.manifest,
+                                import_log=args.import_log,
+                                decoded_cache=decoded_cache,
+                                participant_ids=args.participant_ids,
+                                incremental=args.incremental, output_modes=output_modes,
+                                overwrite=args.overwrite)
+    if args.metrics or args.profile or args.trace_memory:
+        run_instrumented(run, metrics_path=args.metrics, profile_path=args.profile,
+                         trace_memory=args.trace_memory)
+    else:
+        run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import argparse
+import os
+from datetime import datetime, timezone
+import numpy as np
+from processed_manifest import MANIFEST_FILE, load_manifest
+
+## Interval index of the Avro chunks of each participant and sensor.
+# Each Avro file holds about 30 minutes from its timestampStart on, and the
+# converters append files one after another without checking that they
+# follow each other. To tell where a recording really stops, or where two
+# files cover the same time, each record (chunk) of a converted file is
+# recorded as the [start, end) its uniformly sampled sensors span, in µs:
+#   start = timestampStart, end = start + samples * 1e6 / samplingFrequency
+# taken from the full-resolution decode, before any output mode. The
+# intervals are kept in the file's commit line of the processed-file
+# manifest ("intervals": {"eda": [[start, end], ...], ...}), so they are
+# committed and rolled back together with the rows they describe, and
+# build_interval_index() reads them back in one pass over the manifest:
+#   index[(participant_id, sensor)] = {'start', 'end', 'paths', 'merged'}
+# with the chunks sorted by start and 'merged' their union. Queries are
+# then a few vectorized operations on those arrays:
+#   gaps()            - holes longer than min_gap_s between covered time
+#   overlaps()        - chunks covering time an earlier chunk already covers
+#                       (re-synced or duplicated files)
+#   coverage()        - covered (wear) seconds of a span; daily_coverage()
+#                       per UTC day
+#   segments()        - contiguous covered spans, to split an analysis on
+#                       real gaps
+#   covered_seconds() - how much of an interval is already covered, which
+#                       ingestion uses to report files overlapping earlier ones
+# Files committed before intervals were recorded fall back to the [first,
+# last] timestamps of their sensor statistics, one interval per file. Moved
+# copies of a file (same SHA-256) are counted once.
+#
+# Example: python interval_index.py C:/Data/Output --participant 1-1-001 --min-gap 60
+
+# Sensors with a sampling rate; tags and systolic peaks are events
+INTERVAL_SENSORS = ("accelerometer", "gyroscope", "eda", "temperature", "bvp", "steps")
+
+DAY_US = 86_400_000_000
+
+
+def record_intervals(sensors, metadata):
+    """[start, end) of each uniformly sampled sensor of one decoded record.
+
+    `metadata` maps each sensor to its rawData dict, or to the decoded-file
+    cache's metadata, which hold its samplingFrequency.
+    """
+    intervals = {}
+    for name in INTERVAL_SENSORS:
+        columns = sensors.get(name)
+        rate = metadata.get(name, {}).get("samplingFrequency")
+        if not columns or not rate:
+            continue
+        timestamps = next(iter(columns.values()))
+        if len(timestamps):
+            start = int(timestamps[0])
+            intervals[name] = [start, start + int(round(len(timestamps) * 1e6 / rate))]
+    return intervals
+
+
+def group_intervals(records):
+    """{sensor: [[start, end], ...]} of a file from the record_intervals() of its records."""
+    grouped = {}
+    for intervals in records:
+        for name, interval in intervals.items():
+            grouped.setdefault(name, []).append(interval)
+    return grouped
+
+
+def entry_intervals(entry):
+    """{sensor: [[start, end], ...]} of a manifest commit entry."""
+    if 'intervals' in entry:
+        return entry['intervals']
+    # Committed before intervals were recorded: one interval per file
+    return {name: [[stats['first'], stats['last']]]
+            for name, stats in entry.get('sensors', {}).items()
+            if name in INTERVAL_SENSORS and stats.get('first') is not None}
+
+
+def merge_spans(start, end, max_gap_us=0):
+    """Union of intervals sorted by start, joining those at most max_gap_us apart."""
+    if not len(start):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    reach = np.maximum.accumulate(end)
+    first = np.flatnonzero(np.r_[True, start[1:] - reach[:-1] > max_gap_us])
+    return start[first], np.maximum.reduceat(end, first)
+
+
+def make_entry(start, end, paths):
+    """Index entry of one participant and sensor, sorted by start."""
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    order = np.lexsort((end, start))
+    start, end = start[order], end[order]
+    return {'start': start, 'end': end, 'paths': [paths[i] for i in order],
+            'merged': merge_spans(start, end)}
+
+
+def add_file_intervals(index, avro_file_path, intervals):
+    """Add the {sensor: [[start, end], ...]} of one file to an index."""
+    participant_id = os.path.basename(avro_file_path).split('_')[0]
+    for name, spans in intervals.items():
+        if not spans:
+            continue
+        old = index.get((participant_id, name)) or empty_entry()
+        spans = np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+        index[(participant_id, name)] = make_entry(
+            np.concatenate([old['start'], spans[:, 0]]),
+            np.concatenate([old['end'], spans[:, 1]]),
+            old['paths'] + [avro_file_path] * len(spans))
+
+
+def build_interval_index(manifest):
+    """Interval index of every file committed to a loaded manifest."""
+    collected = {}
+    seen = set()
+    for path, entry in manifest['files'].items():
+        if entry['sha256'] in seen:
+            continue
+        seen.add(entry['sha256'])
+        participant_id = os.path.basename(path).split('_')[0]
+        for name, spans in entry_intervals(entry).items():
+            lists = collected.setdefault((participant_id, name), ([], [], []))
+            for start, end in spans:
+                lists[0].append(start)
+                lists[1].append(end)
+                lists[2].append(path)
+    return {key: make_entry(*lists) for key, lists in collected.items()}
+
+
+def load_interval_index(output_dir, manifest_path=None):
+    """Interval index of a converter output folder, read from its manifest."""
+    manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_FILE)
+    return build_interval_index(load_manifest(manifest_path, compact=False))
+
+
+def empty_entry():
+    return make_entry([], [], [])
+
+
+def segments(index, participant_id, sensor, max_gap_s=0):
+    """Contiguous covered spans as (start, end) µs, bridging gaps up to max_gap_s."""
+    entry = index.get((participant_id, sensor)) or empty_entry()
+    start, end = merge_spans(entry['start'], entry['end'], int(max_gap_s * 1e6))
+    return list(zip(start.tolist(), end.tolist()))
+
+
+def gaps(index, participant_id, sensor, min_gap_s=0):
+    """Uncovered (start, end) µs between the first and last chunk, longer than min_gap_s."""
+    entry = index.get((participant_id, sensor)) or empty_entry()
+    start, end = entry['merged']
+    holes = np.stack([end[:-1], start[1:]], axis=1)
+    holes = holes[holes[:, 1] - holes[:, 0] > min_gap_s * 1e6]
+    return [tuple(hole) for hole in holes.tolist()]
+
+
+def overlaps(index, participant_id, sensor, min_overlap_s=0):
+    """Chunks starting before earlier chunks end.
+
+    Returns (start, end, path, earlier_path) for each overlap longer than
+    min_overlap_s, where [start, end) is the time both cover and
+    earlier_path the file of the earlier chunk reaching furthest.
+    """
+    entry = index.get((participant_id, sensor)) or empty_entry()
+    start, end = entry['start'], entry['end']
+    if len(start) < 2:
+        return []
+    reach = np.maximum.accumulate(end)
+    # Chunk holding the running maximum of end
+    holder = np.maximum.accumulate(np.where(end == reach, np.arange(len(end)), 0))
+    overlap_end = np.minimum(end[1:], reach[:-1])
+    found = np.flatnonzero(overlap_end - start[1:] > min_overlap_s * 1e6)
+    return [(int(start[i + 1]), int(overlap_end[i]), entry['paths'][i + 1],
+             entry['paths'][holder[i]]) for i in found]
+
+
+def covered_seconds(index, participant_id, sensor, start_us, end_us):
+    """Seconds of [start_us, end_us) covered by the indexed chunks."""
+    entry = index.get((participant_id, sensor)) or empty_entry()
+    start, end = entry['merged']
+    lo = np.searchsorted(end, start_us, side='right')
+    hi = np.searchsorted(start, end_us, side='left')
+    clipped = np.minimum(end[lo:hi], end_us) - np.maximum(start[lo:hi], start_us)
+    return float(clipped[clipped > 0].sum()) / 1e6
+
+
+def coverage(index, participant_id, sensor, start_us=None, end_us=None):
+    """Covered (wear) seconds of a participant's sensor, optionally within a span."""
+    entry = index.get((participant_id, sensor)) or empty_entry()
+    start, end = entry['merged']
+    if not len(start):
+        return 0.0
+    start_us = int(start[0]) if start_us is None else start_us
+    end_us = int(end[-1]) if end_us is None else end_us
+    return covered_seconds(index, participant_id, sensor, start_us, end_us)
+
+
+def daily_coverage(index, participant_id, sensor):
+    """{'YYYY-MM-DD': covered seconds} for each UTC day from the first to the last chunk."""
+    entry = index.get((participant_id, sensor)) or empty_entry()
+    start, end = entry['merged']
+    if not len(start):
+        return {}
+    days = {}
+    for day_start in range(int(start[0]) // DAY_US * DAY_US, int(end[-1]), DAY_US):
+        date = datetime.fromtimestamp(day_start / 1e6, tz=timezone.utc).date().isoformat()
+        days[date] = covered_seconds(index, participant_id, sensor, day_start,
+                                     day_start + DAY_US)
+    return days
+
+
+def format_us(timestamp_us):
+    return datetime.fromtimestamp(timestamp_us / 1e6, tz=timezone.utc).strftime(
+        "%Y-%m-%d %H:%M:%S")
+
+
+def print_report(index, participant_id=None, sensors=INTERVAL_SENSORS, min_gap_s=60):
+    """Coverage, gaps and overlaps of each indexed participant and sensor."""
+    for key in sorted(index):
+        pid, sensor = key
+        if sensor not in sensors or participant_id not in (None, pid):
+            continue
+        found_gaps = gaps(index, pid, sensor, min_gap_s)
+        found_overlaps = overlaps(index, pid, sensor)
+        print(f"{pid} {sensor}: {len(index[key]['start'])} chunks, "
+              f"{coverage(index, pid, sensor) / 3600:.1f} h covered, "
+              f"{len(found_gaps)} gaps >= {min_gap_s:g} s "
+              f"({sum(b - a for a, b in found_gaps) / 3.6e9:.1f} h), "
+              f"{len(found_overlaps)} overlaps")
+        if participant_id is not None:
+            for a, b in found_gaps:
+                print(f"  gap     {format_us(a)} - {format_us(b)} ({(b - a) / 1e6:.0f} s)")
+            for a, b, path, earlier in found_overlaps:
+                print(f"  overlap {format_us(a)} - {format_us(b)} ({(b - a) / 1e6:.1f} s): "
+                      f"{os.path.basename(path)} / {os.path.basename(earlier)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the coverage, gaps and overlaps of "
+                                                 "the converted Avro chunks.")
+    parser.add_argument("output_dir")
+    parser.add_argument("--manifest", default=None,
+                        help=f"processed-file manifest (default: <output_dir>/{MANIFEST_FILE})")
+    parser.add_argument("--participant", default=None,
+                        help="only this participant, listing each gap and overlap")
+    parser.add_argument("--sensor", action="append", choices=INTERVAL_SENSORS, default=None)
+    parser.add_argument("--min-gap", type=float, default=60,
+                        help="shortest gap reported, in seconds")
+    args = parser.parse_args()
+    print_report(load_interval_index(args.output_dir, args.manifest), args.participant,
+                 args.sensor or INTERVAL_SENSORS, args.min_gap)
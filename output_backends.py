@@ -0,0 +1,220 @@
+import functools
+import operator
+import os
+import re
+from datetime import datetime, timezone
+import numpy as np
+from pipeline_metrics import stage
+from sensor_decode import SENSOR_FILES, TIMESTAMP_SCALE
+
+## Columnar output backends for decoded sensor data.
+# Instead of appending text rows to one CSV per sensor, each Avro file is
+# written as one typed part file per sensor, partitioned the Hive way:
+#   <output_dir>/<sensor>/participant_id=<id>/date=<YYYY-MM-DD>/<avro name>-<record>.parquet
+# Timestamps stay int64 and float values are stored as float32, so readers can
+# load a single participant, day and set of columns without parsing text.
+# Rewriting a part file is idempotent, so reprocessing a file never duplicates
+# rows. pyarrow is only imported when one of these formats is used.
+
+# Extension of the part files written by each columnar format
+OUTPUT_FORMATS = {
+    "parquet": ".parquet",
+    "feather": ".feather",
+}
+
+# participant_data/<date>/<id>/raw_data/... as synced by Empatica
+LAYOUT_DATE = re.compile(r"participant_data[/\\](\d{4}-\d{2}-\d{2})[/\\]")
+
+# <participant>_<timestampStart in unix seconds>.avro
+NAME_TIMESTAMP = re.compile(r"_(\d{9,11})\.avro$")
+
+
+def import_pyarrow():
+    """Import pyarrow, which is only needed for the columnar formats."""
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The parquet and feather output formats require pyarrow "
+                          "(pip install pyarrow).") from e
+    return pyarrow
+
+
+def sensor_name(sensor):
+    """Directory name of a sensor, matching its CSV file name (e.g. systolic_peaks).
+
+    Accepts either the rawData name (systolicPeaks) or the directory name itself.
+    """
+    return os.path.splitext(SENSOR_FILES.get(sensor, sensor))[0]
+
+
+def partition_values(avro_file_path, sensors, participant_id=None):
+    """Return the (participant_id, date) partition of a decoded Avro file.
+
+    The participant defaults to the file name prefix (1-1-001 for
+    1-1-001_1728078992.avro), as in the CSV output. The date is the same for
+    every sensor of the file: the participant_data/<date>/ folder, else the
+    UTC date of the unix-seconds name suffix, else of the first timestamp of
+    the decoded `sensors` ({sensor: columns}), uniformly sampled ones first.
+    """
+    name = os.path.basename(avro_file_path)
+    if participant_id is None:
+        participant_id = name.split('_')[0]
+    match = LAYOUT_DATE.search(avro_file_path)
+    if match:
+        return participant_id, match.group(1)
+    match = NAME_TIMESTAMP.search(name)
+    if match:
+        seconds = int(match.group(1))
+    else:
+        # Sensors with rescaled timestamps (systolic peaks, in ns) last
+        for sensor, columns in sorted(sensors.items(), key=lambda item: item[0] in TIMESTAMP_SCALE):
+            timestamps = next(iter(columns.values()), ())
+            if len(timestamps):
+                seconds = int(timestamps[0]) / TIMESTAMP_SCALE.get(sensor, 1) / 1e6
+                break
+        else:
+            return participant_id, "unknown"
+    return participant_id, datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%d")
+
+
+def to_arrow_table(columns):
+    """Build an Arrow table from decoded columns, storing floats as float32."""
+    pa = import_pyarrow()
+    arrays = {}
+    for name, col in columns.items():
+        if np.issubdtype(col.dtype, np.floating):
+            col = col.astype(np.float32)
+        arrays[name] = pa.array(col)
+    return pa.table(arrays)
+
+
+def write_partitioned(output_dir, sensor, columns, avro_file_path,
+                      participant_id=None, output_format="parquet", chunk=0, date=None):
+    """Write one sensor of one record (chunk) of an Avro file as a columnar part file.
+
+    Pass the `date` of partition_values() for the whole file, so its sensors
+    share one partition; by default it is worked out from this sensor alone.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}; "
+                         f"expected one of {sorted(OUTPUT_FORMATS)}.")
+    if date is None:
+        participant_id, date = partition_values(avro_file_path, {sensor: columns},
+                                                participant_id)
+    elif participant_id is None:
+        participant_id = os.path.basename(avro_file_path).split('_')[0]
+    part_dir = os.path.join(output_dir, sensor_name(sensor),
+                            f"participant_id={participant_id}", f"date={date}")
+    os.makedirs(part_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(avro_file_path))[0]
+    part_path = os.path.join(part_dir, f"{stem}-{chunk}{OUTPUT_FORMATS[output_format]}")
+
+    pa = import_pyarrow()
+    with stage(f"write_{output_format}.{sensor_name(sensor)}") as counts:
+        table = to_arrow_table(columns)
+        # Write to a temporary name first so readers never see a half-written part
+        # (a leading dot also hides it from pyarrow.dataset)
+        tmp_path = os.path.join(part_dir, "." + os.path.basename(part_path) + ".tmp")
+        if output_format == "parquet":
+            pa.parquet.write_table(table, tmp_path)
+        else:
+            pa.feather.write_feather(table, tmp_path)
+        os.replace(tmp_path, part_path)
+        counts['rows'] = table.num_rows
+        counts['bytes'] = os.path.getsize(part_path)
+    return part_path
+
+
+def open_dataset(output_dir, sensor, output_format="parquet"):
+    """pyarrow dataset of the part files of one sensor.
+
+    Opening it lists every part file, so callers reading a sensor many times
+    open it once and pass it to read_partitioned() and partitioned_span().
+    """
+    pa = import_pyarrow()
+    import pyarrow.dataset as ds
+    partitioning = ds.partitioning(
+        pa.schema([("participant_id", pa.string()), ("date", pa.string())]), flavor="hive")
+    return ds.dataset(os.path.join(output_dir, sensor_name(sensor)),
+                      format="ipc" if output_format == "feather" else "parquet",
+                      partitioning=partitioning)
+
+
+def read_partitioned(output_dir, sensor, participant_id=None, date=None, columns=None,
+                     output_format="parquet", start=None, end=None, dataset=None):
+    """Load one sensor as a DataFrame, reading only the matching partitions and columns.
+
+    `participant_id` and `date` may be a single value or a list of values.
+    `start` and `end` keep the rows with start <= timestamp < end, in the unit
+    of the sensor's timestamp column; parquet row groups outside the range
+    are skipped from their statistics. `dataset` is the sensor's
+    open_dataset(), opened here when not given.
+    """
+    import pyarrow.dataset as ds
+    if dataset is None:
+        dataset = open_dataset(output_dir, sensor, output_format)
+    conditions = []
+    for field, value in (("participant_id", participant_id), ("date", date)):
+        if value is None:
+            continue
+        values = [value] if isinstance(value, str) else list(value)
+        conditions.append(ds.field(field).isin(values))
+    # The timestamp is the first column of every part file
+    timestamp = ds.field(dataset.schema.names[0])
+    if start is not None:
+        conditions.append(timestamp >= start)
+    if end is not None:
+        conditions.append(timestamp < end)
+    expression = functools.reduce(operator.and_, conditions) if conditions else None
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def row_group_bounds(metadata, column):
+    """(min, max) of a column over the row groups of a parquet file, from their statistics.
+
+    None when a non-empty row group has no statistics for it.
+    """
+    position = metadata.schema.names.index(column)
+    bounds = None
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        if row_group.num_rows == 0:
+            continue
+        statistics = row_group.column(position).statistics
+        if statistics is None or not statistics.has_min_max:
+            return None
+        bounds = ((statistics.min, statistics.max) if bounds is None
+                  else (min(bounds[0], statistics.min), max(bounds[1], statistics.max)))
+    return bounds or (None, None)
+
+
+def partitioned_span(output_dir, sensor, participant_id=None, output_format="parquet",
+                     dataset=None):
+    """Smallest and largest timestamp of a sensor's part files, or None without rows.
+
+    Parquet files answer from the row-group statistics in their footers;
+    feather files, which keep none, are read one at a time for the timestamp
+    column only, so a span never loads more than one part file.
+    """
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    if dataset is None:
+        dataset = open_dataset(output_dir, sensor, output_format)
+    # The timestamp is the first column of every part file
+    column = dataset.schema.names[0]
+    condition = None if participant_id is None else ds.field("participant_id") == participant_id
+    first = last = None
+    for fragment in dataset.get_fragments(filter=condition):
+        bounds = None
+        if output_format != "feather":
+            bounds = row_group_bounds(fragment.metadata, column)
+        if bounds is None:
+            extremes = pc.min_max(fragment.to_table(columns=[column]).column(column))
+            bounds = extremes["min"].as_py(), extremes["max"].as_py()
+        if bounds[0] is None:
+            continue
+        first = bounds[0] if first is None else min(first, bounds[0])
+        last = bounds[1] if last is None else max(last, bounds[1])
+    return None if first is None else (first, last)
@@ -0,0 +1,198 @@
+import numpy as np
+from sensor_decode import imu_deltas
+
+## Reduced output modes of the sensor processors.
+# By default every sample is written at full precision, so accelerometer.csv
+# and gyroscope.csv (32-64 Hz, three 17-digit floats per row) make up most of
+# the output and most of the time spent loading it. A sensor can instead be
+# written in one of these modes, chosen per sensor as "<mode>[:<parameter>]":
+#   raw              - every sample as decoded (the default)
+#   decimate:<hz>    - anti-aliased decimation to <hz>, which must divide the
+#                      sampling rate (polyphase FIR low-pass, scipy)
+#   summary:<s>      - one row per <s>-second window: sample count, mean and
+#                      std of each axis and of the x/y/z magnitude for IMU
+#                      sensors, mean/std/min/max for the others
+#   precision:<n>    - values rounded to <n> decimal places
+#   counts           - IMU sensors only: the raw integer ADC counts, with the
+#                      delta_physical and delta_digital of imuParams, so that
+#                      value = count * delta_physical / delta_digital exactly
+# Modes are applied in order when several are given, e.g.
+# "decimate:8,precision:4". They run right after decoding, in the pool
+# workers when there are any, and are applied to the decoded-file cache's
+# full-resolution columns when reading from it.
+#
+# Every record is reduced on its own. Decimation pads each record's ends by
+# extrapolating a line, and a summary window cut by the end of a record is
+# written as two rows. Each summary row is stamped with the timestamp of its
+# first sample, so the two halves of such a window stay distinct for the
+# offset-index deduplication; unix_timestamp // (s * 1e6) gives the window.
+#
+# A reduced output has different columns, or fewer rows, than a raw one, so
+# sensor_query/sensor_align/sensor_features expect raw outputs and a folder
+# should keep one mode per sensor: appending rows of another mode to an
+# existing CSV is refused (see csv_writers.open_output()).
+
+IMU_SENSORS = ("accelerometer", "gyroscope")
+
+# Sensors each mode can be applied to
+MODE_SENSORS = {
+    "raw": ("accelerometer", "gyroscope", "eda", "temperature", "tags", "bvp", "systolicPeaks",
+            "steps"),
+    "decimate": ("accelerometer", "gyroscope", "eda", "temperature", "bvp"),
+    "summary": ("accelerometer", "gyroscope", "eda", "temperature", "bvp", "steps"),
+    "precision": ("accelerometer", "gyroscope", "eda", "temperature", "bvp"),
+    "counts": IMU_SENSORS,
+}
+
+
+def parse_mode(sensor, spec):
+    """Parse "mode[:parameter],..." into a list of (mode, parameter) steps."""
+    steps = []
+    for part in spec.split(","):
+        mode, _, parameter = part.strip().partition(":")
+        if mode not in MODE_SENSORS:
+            raise ValueError(f"Unknown output mode {mode!r}; expected one of "
+                             f"{sorted(MODE_SENSORS)}.")
+        if sensor not in MODE_SENSORS[mode]:
+            raise ValueError(f"Output mode {mode!r} cannot be used for {sensor}.")
+        if mode in ("raw", "counts"):
+            if parameter:
+                raise ValueError(f"Output mode {mode!r} takes no parameter.")
+            value = None
+        elif mode == "precision":
+            value = int(parameter)
+            if value < 0:
+                raise ValueError("precision needs a number of decimal places >= 0.")
+        else:
+            value = float(parameter)
+            if value <= 0:
+                raise ValueError(f"{mode} needs a positive "
+                                 f"{'rate in Hz' if mode == 'decimate' else 'window in seconds'}.")
+        if mode == "counts" and steps:
+            raise ValueError("counts works on the decoded values and must come first.")
+        steps.append((mode, value))
+    if len(steps) > 1 and ("counts", None) in steps:
+        raise ValueError("counts cannot be combined with other modes.")
+    return [step for step in steps if step[0] != "raw"]
+
+
+def parse_output_modes(modes):
+    """Validate output modes given as {sensor: spec} or ["sensor=spec", ...].
+
+    Returns {sensor: spec} with the raw sensors left out, a plain dict that
+    can be passed to pool workers.
+    """
+    if not modes:
+        return {}
+    if not isinstance(modes, dict):
+        pairs = {}
+        for item in modes:
+            sensor, sep, spec = item.partition("=")
+            if not sep:
+                raise ValueError(f"Output mode {item!r} is not of the form sensor=mode.")
+            pairs[sensor.strip()] = spec
+        modes = pairs
+    parsed = {}
+    for sensor, spec in modes.items():
+        if sensor not in MODE_SENSORS["raw"]:
+            raise ValueError(f"Unknown sensor {sensor!r}; expected one of "
+                             f"{sorted(MODE_SENSORS['raw'])}.")
+        if parse_mode(sensor, spec):
+            parsed[sensor] = spec
+    return parsed
+
+
+def decimate(columns, metadata, rate):
+    """Low-pass filter and keep every q-th sample, q = samplingFrequency / rate."""
+    factor = metadata["samplingFrequency"] / rate
+    q = int(round(factor))
+    if q < 1 or abs(factor - q) > 1e-6:
+        raise ValueError(f"Cannot decimate {metadata['samplingFrequency']} Hz to {rate} Hz; "
+                         f"the rate must divide the sampling rate.")
+    timestamp_col, *value_cols = columns
+    timestamps = columns[timestamp_col]
+    if q == 1 or len(timestamps) == 0:
+        return columns
+    # scipy is only needed for this mode
+    from scipy.signal import resample_poly
+    # The polyphase filter keeps samples 0, q, 2q, ... of the filtered signal
+    decimated = {timestamp_col: timestamps[::q]}
+    for column in value_cols:
+        decimated[column] = resample_poly(columns[column].astype(np.float64), 1, q,
+                                          padtype="line")
+    return decimated
+
+
+def reduce_windows(ufunc, array, starts):
+    """ufunc.reduceat() over the windows beginning at `starts`, which may be empty."""
+    return ufunc.reduceat(array, starts) if len(starts) else np.empty(0)
+
+
+def summarize(columns, window_s, imu=False):
+    """One row per window of window_s seconds, stamped with its first sample."""
+    timestamp_col, *value_cols = columns
+    timestamps = columns[timestamp_col]
+    window = timestamps // int(window_s * 1e6)
+    starts = np.flatnonzero(np.diff(window, prepend=window[:1] - 1))
+    counts = np.diff(np.r_[starts, len(timestamps)])
+
+    values = {column: columns[column].astype(np.float64) for column in value_cols}
+    if imu:
+        values["magnitude"] = np.sqrt(sum(values[axis] ** 2 for axis in value_cols))
+    summary = {timestamp_col: timestamps[starts], "samples": counts}
+    for column, array in values.items():
+        mean = reduce_windows(np.add, array, starts) / counts
+        # Two passes, which stays accurate where a sum of squares would cancel
+        deviations = (array - np.repeat(mean, counts)) ** 2
+        summary[f"{column}_mean"] = mean
+        summary[f"{column}_std"] = np.sqrt(reduce_windows(np.add, deviations, starts) / counts)
+        if not imu:
+            summary[f"{column}_min"] = reduce_windows(np.minimum, array, starts)
+            summary[f"{column}_max"] = reduce_windows(np.maximum, array, starts)
+    return summary
+
+
+def reduce_precision(columns, digits):
+    """Round the float columns to `digits` decimal places."""
+    return {column: np.round(values, digits) if values.dtype.kind == "f" else values
+            for column, values in columns.items()}
+
+
+def adc_counts(columns, metadata):
+    """The integer ADC counts behind decoded IMU columns, with their scale."""
+    delta_physical, delta_digital = imu_deltas(metadata)
+    timestamp_col, *axes = columns
+    n = len(columns[timestamp_col])
+    counts = {timestamp_col: columns[timestamp_col]}
+    for axis in axes:
+        counts[axis] = np.rint(columns[axis] * delta_digital / delta_physical).astype(np.int64)
+    counts["delta_physical"] = np.full(n, delta_physical)
+    counts["delta_digital"] = np.full(n, delta_digital)
+    return counts
+
+
+def apply_output_modes(sensors, metadata, output_modes):
+    """Apply the output modes to a record's decoded sensors.
+
+    `metadata` maps each sensor to its rawData dict, or anything else holding
+    its samplingFrequency and imuParams (such as the decoded-file cache's
+    record metadata).
+    """
+    if not output_modes:
+        return sensors
+    reduced = dict(sensors)
+    for name, spec in output_modes.items():
+        if name not in reduced:
+            continue
+        columns = reduced[name]
+        for mode, value in parse_mode(name, spec):
+            if mode == "decimate":
+                columns = decimate(columns, metadata[name], value)
+            elif mode == "summary":
+                columns = summarize(columns, value, imu=name in IMU_SENSORS)
+            elif mode == "precision":
+                columns = reduce_precision(columns, value)
+            elif mode == "counts":
+                columns = adc_counts(columns, metadata[name])
+        reduced[name] = columns
+    return reduced
@@ -0,0 +1,109 @@
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import functools
+import os
+from avro_stream import iter_sensor_chunks
+from decoded_cache import iter_cached_sensor_chunks
+from pipeline_metrics import collecting, merge_stages, start_metrics, stop_metrics
+
+## Decode Avro files in a process pool and hand them back in a fixed order.
+# Workers only decode; the results are yielded to the parent process in the
+# order of the input list, so a single writer per output CSV appends them
+# sequentially and the output never depends on which worker finishes first.
+
+
+def avro_sort_key(avro_file_path):
+    """Sort key (participant, timestampStart) from a name like 1-1-001_1728078992.avro."""
+    name = os.path.splitext(os.path.basename(avro_file_path))[0]
+    participant, _, timestamp = name.rpartition('_')
+    if not timestamp.isdigit():
+        return (name, 0, avro_file_path)
+    return (participant, int(timestamp), avro_file_path)
+
+
+def sensor_chunks(avro_file_path, reader=None, decoded_cache=None, output_modes=None,
+                  intervals=None, identity=None):
+    """iter_sensor_chunks(), going through the decoded-file cache when one is given.
+
+    Only the cache hashes the file, so `identity` stays empty without one.
+    """
+    if decoded_cache is None:
+        return iter_sensor_chunks(avro_file_path, reader, output_modes, intervals)
+    return iter_cached_sensor_chunks(avro_file_path, decoded_cache, reader, output_modes,
+                                     intervals, identity)
+
+
+def decode_avro_file(avro_file_path, reader=None, decoded_cache=None, output_modes=None,
+                     metrics=False):
+    """Read a single Avro file and decode the sensors of all of its records.
+
+    Used by pool workers, which have to hand back a picklable list; the serial
+    path streams sensor_chunks() instead. Returns (chunks, record intervals,
+    file identity, stages); the first three are None when the file was
+    removed before it could be read. With metrics, stages is the stage table
+    (see pipeline_metrics.stop_metrics) of this file, for the parent to merge.
+    """
+    intervals = []
+    identity = {}
+    if metrics:
+        start_metrics()
+    try:
+        chunks = list(sensor_chunks(avro_file_path, reader, decoded_cache, output_modes,
+                                    intervals, identity))
+    except FileNotFoundError as e:
+        if e.filename != avro_file_path:
+            raise
+        chunks = intervals = identity = None
+    finally:
+        stages = stop_metrics()['stages'] if metrics else None
+    return chunks, intervals, identity, stages
+
+
+def ordered_map(executor, fn, items, window):
+    """Like executor.map, but with at most `window` results in flight at once."""
+    pending = collections.deque()
+    for item in items:
+        pending.append((item, executor.submit(fn, item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def iter_decoded_files(avro_files, workers=1, reader=None, decoded_cache=None,
+                       output_modes=None):
+    """Yield (avro_file, decoded sensor chunks, record intervals, identity) in input order.
+
+    Files are decoded with `workers` processes. With a single worker the
+    chunks are a generator, so one record at a time is in memory, and the
+    intervals list (see interval_index.record_intervals) fills up as they
+    are consumed; pool workers return each file's chunks and intervals as
+    lists, or None for both when the file was removed before they read it.
+    `decoded_cache` is an open_decoded_cache() dict to read and fill, and
+    `output_modes` the {sensor: mode} reductions applied after decoding.
+    With a decoded_cache, the identity dict holds the file_identity() the
+    cache key was hashed from, once the first chunk has been read; it is
+    empty otherwise. When stage metrics are being collected, the stages the
+    pool workers record are merged into them.
+    """
+    if workers <= 1:
+        for avro_file in avro_files:
+            intervals = []
+            identity = {}
+            yield avro_file, sensor_chunks(avro_file, reader, decoded_cache, output_modes,
+                                           intervals, identity), intervals, identity
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep two files per worker queued so workers never wait on the writer
+        # while bounding how many decoded files sit in memory.
+        decoded = ordered_map(executor, functools.partial(decode_avro_file, reader=reader,
+                                                          decoded_cache=decoded_cache,
+                                                          output_modes=output_modes,
+                                                          metrics=collecting()),
+                              avro_files, 2 * workers)
+        for avro_file, (chunks, intervals, identity, stages) in decoded:
+            if stages:
+                merge_stages(stages)
+            yield avro_file, chunks, intervals, identity
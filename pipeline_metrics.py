@@ -0,0 +1,216 @@
+import contextlib
+import cProfile
+import csv
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+## Per-stage metrics of a conversion run.
+# The converters only print which file they are on, which does not tell
+# where the time goes. The pipeline is instrumented with stage() blocks and
+# the @timed decorator at these points:
+#   read_avro            - reading Avro records (fastavro/avro); bytes = file size
+#   decode               - rawData -> NumPy columns (sensor_decode); rows = samples
+#   decoded_cache        - columns read back from the decoded-file cache
+#   output_modes         - reduction of decoded sensors (output_modes.py)
+#   dedup                - offset-index range check of avro_to_csv_with_ID
+#   write_csv.<file>     - rows formatted into a CSV buffer; bytes = CSV bytes
+#   write_<fmt>.<sensor> - one parquet/feather part file; bytes = file size
+#   flush                - buffered CSV rows handed to the OS
+#   manifest             - journal writes (fsync) of the processed-file manifest
+#   process_avro_file,   - the converter's per-file and per-record functions
+#   write_sensors
+# Every stage records its calls, wall and CPU seconds, rows and bytes. Stages
+# nest, so a stage's time includes the stages inside it. Nothing is recorded,
+# and the blocks cost one check, unless collection was started with
+# start_metrics(); run_instrumented() does that around a whole run and can
+# add a cProfile dump and a tracemalloc summary of the largest allocations.
+#
+# With workers > 1, read_avro, decode, decoded_cache and output_modes run in
+# the pool processes. Each worker collects them for the file it decodes and
+# returns the totals with the file; the parent adds them with merge_stages().
+# Workers run side by side, so their stages can add up to more wall time
+# than the run itself.
+
+# Stage table of the run report, in column order
+STAGE_COLUMNS = ["stage", "calls", "wall_s", "cpu_s", "rows", "bytes", "rows_per_s", "mb_per_s"]
+
+# Allocation sites listed in the report when memory is traced
+TOP_ALLOCATIONS = 15
+
+# The metrics being collected, or None when collection is off
+collector = None
+
+
+def start_metrics():
+    """Start collecting stage metrics in this process, discarding earlier ones."""
+    global collector
+    collector = {
+        'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'wall': time.perf_counter(),
+        'cpu': time.process_time(),
+        'stages': {},
+    }
+
+
+def collecting():
+    """Whether stage metrics are being collected in this process."""
+    return collector is not None
+
+
+def record_stage(name, wall_s, cpu_s, rows=0, nbytes=0, calls=1):
+    """Add `calls` calls of a stage, with their totals, to the active collector."""
+    totals = collector['stages'].setdefault(
+        name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows': 0, 'bytes': 0})
+    totals['calls'] += calls
+    totals['wall_s'] += wall_s
+    totals['cpu_s'] += cpu_s
+    totals['rows'] += int(rows)
+    totals['bytes'] += int(nbytes)
+
+
+@contextlib.contextmanager
+def stage(name, rows=0, nbytes=0):
+    """Time a block as one call of a stage.
+
+    Yields a dict whose 'rows' and 'bytes' the block may set once it knows
+    them; it is simply dropped when no metrics are being collected.
+    """
+    counts = {'rows': rows, 'bytes': nbytes}
+    if collector is None:
+        yield counts
+        return
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield counts
+    finally:
+        if collector is not None:
+            record_stage(name, time.perf_counter() - wall, time.process_time() - cpu,
+                         counts['rows'], counts['bytes'])
+
+
+def merge_stages(stages):
+    """Add the stage table of a report from another process to the active collector."""
+    if collector is None:
+        return
+    for s in stages:
+        record_stage(s['stage'], s['wall_s'], s['cpu_s'], s['rows'], s['bytes'], s['calls'])
+
+
+def timed(fn):
+    """Decorator recording every call of a function as a stage named after it."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if collector is None:
+            return fn(*args, **kwargs)
+        with stage(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def count_rows(sensors):
+    """Number of samples in a dict of decoded sensors."""
+    return sum(len(next(iter(columns.values()))) for columns in sensors.values() if columns)
+
+
+def peak_rss_mb(children=False):
+    """Peak resident set size of this process (or its finished children) in MiB."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def stop_metrics():
+    """Stop collecting and return the run report."""
+    global collector
+    active, collector = collector, None
+    if active is None:
+        return None
+    stages = []
+    for name, totals in sorted(active['stages'].items(), key=lambda item: -item[1]['wall_s']):
+        wall_s = totals['wall_s']
+        stages.append({
+            'stage': name, **totals,
+            'rows_per_s': totals['rows'] / wall_s if wall_s and totals['rows'] else None,
+            'mb_per_s': totals['bytes'] / 1e6 / wall_s if wall_s and totals['bytes'] else None,
+        })
+    return {
+        'started': active['started'],
+        'wall_s': time.perf_counter() - active['wall'],
+        'cpu_s': time.process_time() - active['cpu'],
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': stages,
+    }
+
+
+def write_report(report, path):
+    """Write a run report as JSON, or its stage table as CSV when path ends in .csv."""
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=STAGE_COLUMNS)
+            writer.writeheader()
+            writer.writerows(report['stages'])
+        return
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def format_report(report):
+    """One line per stage, slowest first."""
+    lines = [f"{'stage':<28}{'calls':>8}{'wall s':>10}{'cpu s':>10}{'rows':>12}{'MB':>10}"]
+    for s in report['stages']:
+        lines.append(f"{s['stage']:<28}{s['calls']:>8}{s['wall_s']:>10.3f}{s['cpu_s']:>10.3f}"
+                     f"{s['rows']:>12}{s['bytes'] / 1e6:>10.1f}")
+    lines.append(f"total wall {report['wall_s']:.3f} s, cpu {report['cpu_s']:.3f} s, "
+                 f"peak RSS {report['peak_rss_mb'] or 0:.0f} MiB")
+    return "\n".join(lines)
+
+
+def run_instrumented(fn, *args, metrics_path=None, profile_path=None, trace_memory=False,
+                     **kwargs):
+    """Call fn(*args, **kwargs) collecting stage metrics, and optionally profiles.
+
+    The report is printed, and written to metrics_path when given. With
+    profile_path a cProfile dump is written there (read it with pstats or
+    snakeviz); with trace_memory the report gets the traced peak and the
+    largest allocation sites still alive at the end, at a noticeable cost in
+    speed.
+    """
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    start_metrics()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    finally:
+        report = stop_metrics()
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            report['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1 << 20)
+            tracemalloc.stop()
+            report['top_allocations'] = [
+                {'site': str(statistic.traceback), 'mb': statistic.size / (1 << 20),
+                 'blocks': statistic.count}
+                for statistic in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]]
+        if profiler is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(profile_path)), exist_ok=True)
+            profiler.dump_stats(profile_path)
+        print(format_report(report))
+        if metrics_path:
+            write_report(report, metrics_path)
+    return result
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+from pipeline_metrics import stage
+
+## Manifest of the Avro files that have already been converted.
+# Replaces the plain list of paths in processed_files.txt. Every converted
+# file is recorded with its size, mtime and SHA-256, together with the row
+# count and [first, last] timestamp of each sensor it produced:
+#   {"op": "commit", "path": ..., "size": ..., "mtime_ns": ..., "sha256": ...,
+#    "sensors": {"eda": {"rows": 7200, "first": ..., "last": ...}, ...},
+#    "intervals": {"eda": [[start, end], ...], ...}}
+# where the intervals are the [start, end) of each Avro record (see
+# interval_index.py).
+#
+# The manifest is an append-only journal with one JSON object per line. Before
+# a file is written, a "begin" line records the byte size of every output file;
+# its "commit" line is appended once all outputs are written. A "begin" without
+# a "commit" therefore marks a run that crashed half way, and
+# rollback_pending() truncates the outputs back to those sizes before the file
+# is converted again, so rows are never appended twice.
+#
+# A rescan costs one stat() per file: a file is only hashed when its path is
+# new or its size/mtime changed and some converted file has the same size,
+# which is how moved or re-synced copies are recognised.
+
+MANIFEST_FILE = 'processed_manifest.json'
+
+# Read size when hashing Avro files
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def normalize_path(path):
+    """Absolute path with '/' separators, so C:/a\\b and C:/a/b are the same key."""
+    return os.path.normpath(os.path.abspath(path)).replace('\\', '/')
+
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def apply_entry(manifest, entry):
+    """Replay one journal line into the in-memory manifest."""
+    path = entry['path']
+    if entry['op'] == 'begin':
+        manifest['pending'][path] = entry
+    elif entry['op'] == 'commit':
+        manifest['pending'].pop(path, None)
+        manifest['files'][path] = entry
+        manifest['by_hash'].setdefault(entry['sha256'], entry)
+        manifest['sizes'].add(entry['size'])
+    elif entry['op'] == 'rollback':
+        manifest['pending'].pop(path, None)
+
+
+def load_manifest(manifest_path, compact=True):
+    """Load a manifest journal, ignoring a last line cut short by a crash.
+
+    Returns a dict holding the committed files keyed by normalised path
+    ('files'), the same entries keyed by content hash ('by_hash'), the sizes
+    of converted files ('sizes') and the files begun but never committed
+    ('pending'). Readers that run next to a converter pass compact=False so
+    the journal is never rewritten under it.
+    """
+    manifest = {'path': manifest_path, 'files': {}, 'by_hash': {}, 'sizes': set(), 'pending': {}}
+    if not os.path.exists(manifest_path):
+        return manifest
+    lines = 0
+    with open(manifest_path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            apply_entry(manifest, entry)
+            lines += 1
+    # Drop lines superseded by later ones (begin/rollback pairs, recommits)
+    if compact and lines > len(manifest['files']) + len(manifest['pending']):
+        compact_manifest(manifest)
+    return manifest
+
+
+def compact_manifest(manifest):
+    """Atomically rewrite the journal with one line per file."""
+    tmp_path = manifest['path'] + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for entry in list(manifest['files'].values()) + list(manifest['pending'].values()):
+            f.write(json.dumps(entry) + '\n')
+    os.replace(tmp_path, manifest['path'])
+
+
+def append_entry(manifest, entry):
+    """Durably append one line to the journal and apply it."""
+    with stage('manifest'), open(manifest['path'], 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    apply_entry(manifest, entry)
+
+
+def find_processed(manifest, avro_file_path):
+    """Return the manifest entry of an already converted file, or None.
+
+    An unchanged path, size and mtime is a hit without reading the file. A
+    file with the same content as a converted one (moved or re-synced) is
+    also a hit and is recorded under its new path.
+    """
+    path = normalize_path(avro_file_path)
+    stat = os.stat(avro_file_path)
+    entry = manifest['files'].get(path)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry
+    if stat.st_size not in manifest['sizes']:
+        return None
+    known = manifest['by_hash'].get(file_sha256(avro_file_path))
+    if known is None:
+        return None
+    alias = dict(known, path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    append_entry(manifest, alias)
+    return alias
+
+
+def output_sizes(output_files):
+    """Byte size of each output file, None for files that do not exist yet."""
+    return {path: os.path.getsize(path) if os.path.exists(path) else None
+            for path in output_files}
+
+
+def begin_file(manifest, avro_file_path, output_files=()):
+    """Record that a file is about to be written to `output_files`.
+
+    `output_files` is a list of paths to stat, or a dict of their sizes when
+    the caller already knows them.
+    """
+    if not isinstance(output_files, dict):
+        output_files = output_sizes(output_files)
+    append_entry(manifest, {'op': 'begin', 'path': normalize_path(avro_file_path),
+                            'outputs': output_files})
+
+
+def file_identity(avro_file_path):
+    """Size, mtime and SHA-256 of a file, as recorded by commit_file()."""
+    stat = os.stat(avro_file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha256': file_sha256(avro_file_path)}
+
+
+def commit_file(manifest, avro_file_path, sensor_stats, intervals=None, identity=None):
+    """Record that every output of a file has been written.
+
+    `identity` is the file_identity() taken before it was read, so a file
+    removed while its rows were written can still be committed; by default
+    the file is looked at now.
+    """
+    entry = {'op': 'commit', 'path': normalize_path(avro_file_path),
+             **(identity or file_identity(avro_file_path)), 'sensors': sensor_stats}
+    if intervals is not None:
+        entry['intervals'] = intervals
+    append_entry(manifest, entry)
+
+
+def cancel_file(manifest, avro_file_path):
+    """Close the begin line of a file none of whose rows were written."""
+    append_entry(manifest, {'op': 'rollback', 'path': normalize_path(avro_file_path)})
+
+
+def rollback_pending(manifest):
+    """Undo the writes of files that were begun but never committed.
+
+    Each output is truncated to the size it had before the file was begun
+    (or removed if it did not exist). Returns the outputs that were changed.
+    """
+    changed = []
+    for path, entry in list(manifest['pending'].items()):
+        for output, size in entry['outputs'].items():
+            if not os.path.exists(output):
+                continue
+            if size is None:
+                os.remove(output)
+            elif os.path.getsize(output) > size:
+                with open(output, 'r+b') as f:
+                    f.truncate(size)
+            else:
+                continue
+            changed.append(output)
+        append_entry(manifest, {'op': 'rollback', 'path': path})
+    return changed
+
+
+def update_sensor_stats(stats, sensors):
+    """Add the row counts and timestamp ranges of decoded sensors to `stats`."""
+    for name, columns in sensors.items():
+        timestamps = next(iter(columns.values()))
+        sensor = stats.setdefault(name, {'rows': 0, 'first': None, 'last': None})
+        sensor['rows'] += len(timestamps)
+        if len(timestamps):
+            first, last = int(timestamps.min()), int(timestamps.max())
+            sensor['first'] = first if sensor['first'] is None else min(sensor['first'], first)
+            sensor['last'] = last if sensor['last'] is None else max(sensor['last'], last)
+    return stats
+
+
+def import_path_log(manifest, log_path):
+    """Record the files listed in an old processed_files.txt as converted.
+
+    Their sensor statistics are unknown, so they are stored empty.
+    """
+    if not os.path.exists(log_path):
+        return 0
+    imported = 0
+    with open(log_path, 'r') as f:
+        for line in f:
+            avro_file = line.strip()
+            if not avro_file or not os.path.exists(avro_file):
+                continue
+            if normalize_path(avro_file) in manifest['files']:
+                continue
+            commit_file(manifest, avro_file, {})
+            imported += 1
+    return imported
@@ -0,0 +1,259 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from output_backends import OUTPUT_FORMATS, open_dataset, partitioned_span
+from sensor_decode import SENSOR_FILES, TIMESTAMP_SCALE
+from sensor_query import load, raw_sensor_name, read_offset_index
+
+## Align sensors recorded at different rates onto one time grid.
+# For one participant the chosen sensors are put on a common grid of `rate`
+# Hz, with grid points at whole multiples of the period so that runs and
+# windows line up. The study is walked in windows of WINDOW_S seconds and
+# each window only loads its own rows (plus MARGIN_S on each side) through
+# sensor_query.load(), so memory is bounded by one window of every sensor.
+# The span of a participant comes from the CSV offset indexes, or from the
+# parquet row-group statistics, and each sensor's offset index or part-file
+# dataset is opened once for the whole alignment.
+#
+# Uniformly sampled sensors are resampled by one of:
+#   mean   - average of the samples in [t, t + period); for faster sensors
+#   linear - interpolation at t between the two neighbouring samples; for
+#            slower sensors. Points further than MAX_GAP_PERIODS native
+#            periods from a sample are left NaN, so gaps are not bridged.
+# By default a sensor faster than the grid is averaged and a slower one
+# interpolated. Event streams (tags, systolic peaks) are as-of joined: each
+# grid point gets the time of the last event at or before it (carried across
+# windows) and the number of events in its period. All times are
+# microseconds; systolic peaks are converted from nanoseconds.
+
+WINDOW_S = 60 * 60
+MARGIN_S = 10
+
+# Interpolation does not bridge gaps longer than this many native periods
+MAX_GAP_PERIODS = 2
+
+# Sensors that hold event times rather than sampled values
+EVENT_SENSORS = ("tags", "systolicPeaks")
+
+DEFAULT_SENSORS = ("accelerometer", "eda", "temperature", "bvp", "systolicPeaks")
+
+# Timestamp column of the sensors whose column is not unix_timestamp
+TIMESTAMP_COLUMNS = {
+    "tags": "tags_timestamp",
+    "systolicPeaks": "systolic_peak_timestamp",
+}
+
+# Columns of a loaded sensor that are neither its timestamp nor a value
+KEY_COLUMNS = ("participant_id", "date")
+
+RESAMPLE_METHODS = ("mean", "linear")
+
+
+def grid_start(start_us, period_us):
+    """First whole multiple of the period at or after start_us."""
+    return -(-start_us // period_us) * period_us
+
+
+def grid_times(start_us, end_us, period_us):
+    """Grid points t with start_us <= t < end_us at whole multiples of the period."""
+    return np.arange(grid_start(start_us, period_us), end_us, period_us, dtype=np.int64)
+
+
+def native_period(timestamps):
+    """Median step between samples, or None with fewer than two samples."""
+    if len(timestamps) < 2:
+        return None
+    return float(np.median(np.diff(timestamps)))
+
+
+def resample_mean(timestamps, values, grid, period_us):
+    """Average of the samples in [t, t + period) for every grid point t."""
+    if len(grid) == 0:
+        return np.empty(0)
+    bins = np.searchsorted(grid, timestamps, side="right") - 1
+    inside = (bins >= 0) & (timestamps < grid[-1] + period_us)
+    counts = np.bincount(bins[inside], minlength=len(grid))
+    sums = np.bincount(bins[inside], weights=values[inside], minlength=len(grid))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def resample_linear(timestamps, values, grid, max_gap_us):
+    """Linear interpolation at the grid points, NaN where samples are too far apart."""
+    if len(timestamps) == 0:
+        return np.full(len(grid), np.nan)
+    result = np.interp(grid, timestamps, values, left=np.nan, right=np.nan)
+    after = np.searchsorted(timestamps, grid, side="left")
+    before = np.clip(after - 1, 0, len(timestamps) - 1)
+    after = np.clip(after, 0, len(timestamps) - 1)
+    exact = timestamps[after] == grid
+    gap = timestamps[after] - timestamps[before]
+    result[(gap > max_gap_us) & ~exact] = np.nan
+    return result
+
+
+def asof_events(events, grid, period_us, last_before=None):
+    """Time of the last event at or before each grid point, and the events per period.
+
+    `last_before` is the last event seen before `events` (from an earlier
+    window); grid points with no event yet are NaN.
+    """
+    events = np.sort(events)
+    last = np.full(len(grid), np.nan if last_before is None else float(last_before))
+    latest = np.searchsorted(events, grid, side="right") - 1
+    seen = latest >= 0
+    last[seen] = events[latest[seen]]
+    counts = (np.searchsorted(events, grid + period_us, side="left")
+              - np.searchsorted(events, grid, side="left"))
+    return last, counts
+
+
+def value_columns(sensor, frame):
+    """The value columns of a loaded sensor, named for the merged table."""
+    skip = set(KEY_COLUMNS) | {TIMESTAMP_COLUMNS.get(sensor, "unix_timestamp")}
+    columns = [column for column in frame.columns if column not in skip]
+    if len(columns) == 1:
+        return {columns[0]: columns[0]}
+    return {column: f"{sensor}_{column}" for column in columns}
+
+
+def load_sensor(output_dir, sensor, participant_id, start_us, end_us, output_format,
+                index=None):
+    """Load one sensor's rows in [start_us, end_us) with its timestamps in microseconds."""
+    frame = load(output_dir, sensor, participant_id, start_us, end_us,
+                 output_format=output_format, index=index)
+    timestamps = (frame[TIMESTAMP_COLUMNS.get(sensor, "unix_timestamp")].to_numpy(np.int64)
+                  // TIMESTAMP_SCALE.get(sensor, 1))
+    order = np.argsort(timestamps, kind="stable")
+    return timestamps[order], frame.iloc[order].reset_index(drop=True)
+
+
+def sensor_indexes(output_dir, sensors, output_format="csv"):
+    """Index of each sensor, read once for a whole alignment.
+
+    The offset index of a CSV, or the dataset of parquet/feather part files;
+    either is passed on to sensor_query.load().
+    """
+    if output_format == "csv":
+        return {sensor: read_offset_index(os.path.join(output_dir, SENSOR_FILES[sensor]))
+                for sensor in sensors}
+    return {sensor: open_dataset(output_dir, sensor, output_format) for sensor in sensors}
+
+
+def participant_span(output_dir, participant_id, sensors, output_format="csv", indexes=None):
+    """First and last timestamp (µs) of a participant over the given sensors."""
+    firsts, lasts = [], []
+    if indexes is None:
+        indexes = sensor_indexes(output_dir, sensors, output_format)
+    for sensor in sensors:
+        scale = TIMESTAMP_SCALE.get(sensor, 1)
+        if output_format == "csv":
+            index = indexes[sensor]
+            index = index[index["participant_id"] == participant_id]
+            span = (index["first"].min(), index["last"].max()) if len(index) else None
+        else:
+            span = partitioned_span(output_dir, sensor, participant_id, output_format,
+                                    indexes[sensor])
+        if span is not None:
+            firsts.append(int(span[0]) // scale)
+            lasts.append(int(span[1]) // scale)
+    if not firsts:
+        return None
+    return min(firsts), max(lasts)
+
+
+def iter_aligned(output_dir, participant_id, sensors=DEFAULT_SENSORS, rate=4.0, start_us=None,
+                 end_us=None, methods=None, window_s=WINDOW_S, output_format="csv",
+                 dropna=True):
+    """Yield the merged grid of one participant as DataFrames, one per window.
+
+    `methods` maps sensors to a RESAMPLE_METHODS entry; sensors not in it are
+    averaged when faster than the grid and interpolated otherwise. With
+    `dropna`, grid points where every sensor is missing are dropped, so
+    recording gaps do not produce empty rows.
+    """
+    sensors = [raw_sensor_name(sensor) for sensor in sensors]
+    methods = {raw_sensor_name(sensor): method for sensor, method in (methods or {}).items()}
+    for method in methods.values():
+        if method not in RESAMPLE_METHODS:
+            raise ValueError(f"Unknown resampling method {method!r}; "
+                             f"expected one of {RESAMPLE_METHODS}.")
+    indexes = sensor_indexes(output_dir, sensors, output_format)
+    if start_us is None or end_us is None:
+        span = participant_span(output_dir, participant_id, sensors, output_format, indexes)
+        if span is None:
+            return
+        start_us = span[0] if start_us is None else start_us
+        end_us = span[1] + 1 if end_us is None else end_us
+
+    period_us = int(round(1e6 / rate))
+    window_us = max(int(window_s * 1e6) // period_us, 1) * period_us
+    margin_us = int(MARGIN_S * 1e6)
+    last_events = {}
+    window_start = grid_start(start_us, period_us)
+    while window_start < end_us:
+        grid = grid_times(window_start, min(window_start + window_us, end_us), period_us)
+        merged = {"unix_timestamp": grid}
+        for sensor in sensors:
+            load_start = window_start if sensor in EVENT_SENSORS else window_start - margin_us
+            timestamps, frame = load_sensor(output_dir, sensor, participant_id, load_start,
+                                            window_start + window_us + margin_us, output_format,
+                                            indexes[sensor])
+            if sensor in EVENT_SENSORS:
+                name = os.path.splitext(SENSOR_FILES[sensor])[0]
+                in_window = timestamps[timestamps < window_start + window_us]
+                last, counts = asof_events(in_window, grid, period_us, last_events.get(sensor))
+                if len(in_window):
+                    last_events[sensor] = in_window[-1]
+                merged[f"{name}_last"] = last
+                merged[f"{name}_count"] = counts
+                continue
+            period = native_period(timestamps)
+            method = methods.get(sensor) or ("mean" if period is not None and period < period_us
+                                             else "linear")
+            for column, name in value_columns(sensor, frame).items():
+                values = frame[column].to_numpy(np.float64)
+                if method == "mean":
+                    merged[name] = resample_mean(timestamps, values, grid, period_us)
+                else:
+                    merged[name] = resample_linear(timestamps, values, grid,
+                                                   MAX_GAP_PERIODS * (period or period_us))
+        window = pd.DataFrame(merged)
+        if dropna:
+            sampled = [name for name in window.columns
+                       if name != "unix_timestamp" and not name.endswith(("_last", "_count"))]
+            if sampled:
+                window = window.dropna(subset=sampled, how="all")
+        if len(window):
+            window.insert(0, "participant_id", participant_id)
+            yield window.reset_index(drop=True)
+        window_start += window_us
+
+
+def align_to_csv(output_path, output_dir, participant_id, **kwargs):
+    """Write the merged grid of one participant to a CSV file, one window at a time."""
+    header = True
+    with open(output_path, "w", newline="") as f:
+        for window in iter_aligned(output_dir, participant_id, **kwargs):
+            window.to_csv(f, header=header, index=False)
+            header = False
+
+
+if __name__ == "__main__":
+    # Example usage: python sensor_align.py Output4 1-1-001 aligned.csv --rate 4
+    parser = argparse.ArgumentParser(description="Resample converted sensors onto one time grid.")
+    parser.add_argument("output_dir", help="folder written by the converters")
+    parser.add_argument("participant_id")
+    parser.add_argument("aligned_csv")
+    parser.add_argument("--sensors", nargs="+", default=list(DEFAULT_SENSORS),
+                        choices=sorted(SENSOR_FILES))
+    parser.add_argument("--rate", type=float, default=4.0, help="grid rate (Hz)")
+    parser.add_argument("--start", type=int, default=None, help="first time (µs)")
+    parser.add_argument("--end", type=int, default=None, help="end time (µs, exclusive)")
+    parser.add_argument("--format", dest="output_format", default="csv",
+                        choices=["csv"] + sorted(OUTPUT_FORMATS))
+    args = parser.parse_args()
+    align_to_csv(args.aligned_csv, args.output_dir, args.participant_id, sensors=args.sensors,
+                 rate=args.rate, start_us=args.start, end_us=args.end,
+                 output_format=args.output_format)
@@ -0,0 +1,121 @@
+import itertools
+import numpy as np
+
+## Vectorized decoding of the sensor records in an Empatica "rawData" dict.
+# Each decoder returns the output columns of one sensor as a dict of NumPy
+# arrays, in the order they are written to the CSV files. The results are
+# bit-identical to the per-sample list comprehensions the converters used:
+#   timestamp = round(timestampStart + i * (1e6 / samplingFrequency))
+#   value_g   = val * delta_physical / delta_digital
+
+# Output CSV file of each sensor decoded by decode_raw_data(). The first
+# column of every decoded sensor is its timestamp column.
+SENSOR_FILES = {
+    "accelerometer": "accelerometer.csv",
+    "gyroscope": "gyroscope.csv",
+    "eda": "eda.csv",
+    "temperature": "temperature.csv",
+    "tags": "tags.csv",
+    "bvp": "bvp.csv",
+    "systolicPeaks": "systolic_peaks.csv",
+    "steps": "steps.csv",
+}
+
+# Columns of each decoded sensor, as returned by decode_raw_data()
+SENSOR_COLUMNS = {
+    "accelerometer": ["unix_timestamp", "x", "y", "z"],
+    "gyroscope": ["unix_timestamp", "x", "y", "z"],
+    "eda": ["unix_timestamp", "eda"],
+    "temperature": ["unix_timestamp", "temperature"],
+    "tags": ["tags_timestamp"],
+    "bvp": ["unix_timestamp", "bvp"],
+    "systolicPeaks": ["systolic_peak_timestamp"],
+    "steps": ["unix_timestamp", "steps"],
+}
+
+# Sensors whose timestamp column is not in microseconds, with the factor that
+# converts microseconds to their unit (systolic peaks are in nanoseconds)
+TIMESTAMP_SCALE = {
+    "systolicPeaks": 1000,
+}
+
+
+def sensor_timestamps(sensor, n_samples):
+    """Build the int64 microsecond timestamps of a uniformly sampled sensor."""
+    period = 1e6 / sensor["samplingFrequency"]
+    # np.rint rounds half to even, like Python's round()
+    return np.rint(sensor["timestampStart"] + np.arange(n_samples) * period).astype(np.int64)
+
+
+def timestamp_rate(timestamps):
+    """Sampling rate (Hz) of decoded timestamps (µs), or None with fewer than two.
+
+    The inverse of sensor_timestamps(): the median step gives back the
+    samplingFrequency of the Avro file.
+    """
+    if len(timestamps) < 2:
+        return None
+    return 1e6 / float(np.median(np.diff(timestamps)))
+
+
+def imu_deltas(sensor):
+    """Return (delta_physical, delta_digital) from a sensor's imuParams."""
+    params = sensor["imuParams"]
+    delta_physical = params["physicalMax"] - params["physicalMin"]
+    delta_digital = params["digitalMax"] - params["digitalMin"]
+    return delta_physical, delta_digital
+
+
+def decode_imu(sensor):
+    """Decode accelerometer/gyroscope ADC counts into physical units."""
+    delta_physical, delta_digital = imu_deltas(sensor)
+    # One contiguous (3, n) block; multiply then divide rather than multiplying
+    # by the ratio, so every value rounds exactly like val * dp / dd did.
+    xyz = np.array([sensor["x"], sensor["y"], sensor["z"]], dtype=np.float64)
+    xyz *= delta_physical
+    xyz /= delta_digital
+    return {
+        "unix_timestamp": sensor_timestamps(sensor, xyz.shape[1]),
+        "x": xyz[0],
+        "y": xyz[1],
+        "z": xyz[2],
+    }
+
+
+def decode_values(sensor, column):
+    """Decode a uniformly sampled sensor with a single "values" array."""
+    values = np.asarray(sensor["values"])
+    return {
+        "unix_timestamp": sensor_timestamps(sensor, len(values)),
+        column: values,
+    }
+
+
+def decode_events(times, column):
+    """Decode an event stream (tags, systolic peaks) of int64 timestamps."""
+    return {column: np.asarray(times, dtype=np.int64)}
+
+
+def decode_raw_data(raw_data):
+    """Decode every sensor of a rawData record, keyed by sensor name."""
+    return {
+        "accelerometer": decode_imu(raw_data["accelerometer"]),
+        "gyroscope": decode_imu(raw_data["gyroscope"]),
+        "eda": decode_values(raw_data["eda"], "eda"),
+        "temperature": decode_values(raw_data["temperature"], "temperature"),
+        "tags": decode_events(raw_data["tags"]["tagsTimeMicros"], "tags_timestamp"),
+        "bvp": decode_values(raw_data["bvp"], "bvp"),
+        "systolicPeaks": decode_events(raw_data["systolicPeaks"]["peaksTimeNanos"],
+                                       "systolic_peak_timestamp"),
+        "steps": decode_values(raw_data["steps"], "steps"),
+    }
+
+
+def iter_rows(columns, *prefix):
+    """Iterate CSV rows from decoded columns, optionally led by constant values.
+
+    The arrays are converted with tolist() in one C-level pass, so the rows hold
+    plain Python ints/floats and csv.writer formats them exactly as before.
+    """
+    lists = [col.tolist() for col in columns.values()]
+    return zip(*(itertools.repeat(value) for value in prefix), *lists)
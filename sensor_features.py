@@ -0,0 +1,298 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy import signal
+from eda_analysis import F_LOWER, F_UPPER, FILTER_ORDER, detect_peaks
+from output_backends import OUTPUT_FORMATS
+from processed_manifest import MANIFEST_FILE, load_manifest
+from sensor_align import load_sensor, participant_span, sensor_indexes
+from sensor_decode import SENSOR_FILES, timestamp_rate
+from sensor_query import raw_sensor_name, read_offset_index
+
+## Sliding-window features of EDA, BVP and accelerometer magnitude.
+# Windows of `window_s` seconds start every `step_s` seconds, at whole
+# multiples of the step. A window is only computed when it holds all of its
+# window_s * rate samples, the first within one sample period of its start
+# and none more than two periods after the previous one; MIN_COVERAGE only
+# bounds the timing jitter those samples may add up to. All windows of a
+# contiguous run of samples are gathered into one (windows x samples) matrix,
+# so every feature is a single vectorised NumPy/SciPy call over the batch,
+# except the SCRs, which are found window by window with the peak detector
+# of eda_analysis (prominence, minimum distance) so both count the same SCRs.
+#
+# The sampling rate is not hard-coded: the converters derive every timestamp
+# from the Avro samplingFrequency (timestampStart + i * 1e6 / f), so it is
+# recovered exactly as 1e6 / the median timestamp step (timestamp_rate()).
+#
+# Results are cached in <output_dir>/feature_cache, one CSV per participant,
+# sensor, window/step pair and CACHE_BLOCK_S block of window starts, in a
+# folder per window/step pair so runs with other parameters keep their
+# blocks. The cache is read back with round-trip float parsing, so a cache
+# hit returns the same values as a recompute. The file name holds a
+# hash of the feature parameters and of the converted Avro files whose data
+# the block can reach (their SHA-256 in the processed-file manifest, or the
+# offset-index blocks of the CSV when there is no manifest). Converting a
+# new Avro file therefore only invalidates the blocks it overlaps.
+
+WINDOW_S = 60
+STEP_S = 30
+
+# The samples of a window may span at most (2 - MIN_COVERAGE) window lengths
+MIN_COVERAGE = 0.9
+
+CACHE_DIR = 'feature_cache'
+CACHE_BLOCK_S = 6 * 60 * 60
+
+# Heart-rate band searched in the BVP spectrum (Hz)
+HR_BAND = (0.7, 3.5)
+
+# Bumped whenever a feature definition changes, so stale caches are not reused
+FEATURES_VERSION = 2
+
+
+def eda_features(windows, rate):
+    """Level, spread, trend and SCR count of EDA windows."""
+    sos = signal.butter(FILTER_ORDER, [F_LOWER / (rate / 2), F_UPPER / (rate / 2)], "bandpass",
+                        output="sos")
+    phasic = signal.sosfiltfilt(sos, windows, axis=1)
+    # A window has no margins, so prominences are measured within half of it on either side
+    amplitudes = [detect_peaks(row, rate, margin_s=windows.shape[1] / rate / 2)[1]
+                  for row in phasic]
+    count = np.array([len(found) for found in amplitudes], dtype=np.int64)
+    t = np.arange(windows.shape[1]) / rate
+    slope = np.polyfit(t, windows.T, 1)[0]
+    return {
+        "eda_mean": windows.mean(axis=1),
+        "eda_std": windows.std(axis=1),
+        "eda_min": windows.min(axis=1),
+        "eda_max": windows.max(axis=1),
+        "eda_slope": slope,
+        "scr_count": count,
+        "scr_amplitude_mean": np.array([found.mean() if len(found) else np.nan
+                                        for found in amplitudes]),
+    }
+
+
+def bvp_features(windows, rate):
+    """Spread and dominant heart-rate frequency of BVP windows."""
+    centred = windows - windows.mean(axis=1, keepdims=True)
+    spectrum = np.abs(np.fft.rfft(centred * np.hanning(windows.shape[1]), axis=1))
+    freqs = np.fft.rfftfreq(windows.shape[1], 1 / rate)
+    band = (freqs >= HR_BAND[0]) & (freqs <= HR_BAND[1])
+    peak = spectrum[:, band].argmax(axis=1)
+    return {
+        "bvp_std": windows.std(axis=1),
+        "bvp_range": windows.max(axis=1) - windows.min(axis=1),
+        "heart_rate_bpm": 60 * freqs[band][peak],
+    }
+
+
+def accelerometer_features(windows, rate):
+    """Intensity and variability of accelerometer magnitude windows (in g)."""
+    return {
+        "acc_magnitude_mean": windows.mean(axis=1),
+        "acc_magnitude_std": windows.std(axis=1),
+        "acc_magnitude_max": windows.max(axis=1),
+        # Euclidean norm minus one g, a common wrist activity measure
+        "acc_enmo": np.maximum(windows - 1, 0).mean(axis=1),
+    }
+
+
+def accelerometer_magnitude(frame):
+    xyz = frame[["x", "y", "z"]].to_numpy(np.float64)
+    return np.sqrt((xyz ** 2).sum(axis=1))
+
+
+# Sensor -> (series of a loaded frame, feature function)
+FEATURE_SENSORS = {
+    "eda": (lambda frame: frame["eda"].to_numpy(np.float64), eda_features),
+    "bvp": (lambda frame: frame["bvp"].to_numpy(np.float64), bvp_features),
+    "accelerometer": (accelerometer_magnitude, accelerometer_features),
+}
+
+
+def window_matrix(timestamps, values, starts_us, window_us, rate):
+    """Stack the windows starting at `starts_us` that the samples cover without gaps.
+
+    Returns (kept window starts, windows x samples matrix).
+    """
+    n = int(round(window_us * rate / 1e6))
+    period_us = 1e6 / rate
+    first = np.searchsorted(timestamps, starts_us, side="left")
+    enough = first + n <= len(timestamps)
+    first, starts_us = first[enough], starts_us[enough]
+    if len(first) == 0:
+        return starts_us, np.empty((0, n))
+    index = first[:, None] + np.arange(n)
+    # The window must start within one sample and hold no gap of more than two periods
+    starts_ok = timestamps[first] - starts_us < period_us
+    spans_ok = timestamps[index[:, -1]] - timestamps[first] <= window_us * (2 - MIN_COVERAGE)
+    steps = np.diff(timestamps)
+    gap_free = np.ones(len(first), dtype=bool)
+    gaps = np.flatnonzero(steps > 2 * period_us)
+    if len(gaps):
+        # A window is broken if a gap lies between its first and last sample
+        broken = np.searchsorted(gaps, first, side="left") < np.searchsorted(gaps, index[:, -1],
+                                                                               side="left")
+        gap_free = ~broken
+    keep = starts_ok & spans_ok & gap_free
+    return starts_us[keep], values[index[keep]]
+
+
+def compute_block(output_dir, participant_id, sensor, block_start, block_end, window_s, step_s,
+                  output_format, index=None):
+    """Features of the windows of one sensor that start in [block_start, block_end)."""
+    window_us, step_us = int(window_s * 1e6), int(step_s * 1e6)
+    timestamps, frame = load_sensor(output_dir, sensor, participant_id, block_start,
+                                    block_end + window_us, output_format, index)
+    if len(timestamps) < 2:
+        return pd.DataFrame()
+    rate = timestamp_rate(timestamps)
+    series, feature_fn = FEATURE_SENSORS[sensor]
+    starts = np.arange(-(-block_start // step_us) * step_us, block_end, step_us, dtype=np.int64)
+    starts, windows = window_matrix(timestamps, series(frame), starts, window_us, rate)
+    if len(starts) == 0:
+        return pd.DataFrame()
+    features = pd.DataFrame({"window_start": starts, "window_end": starts + window_us,
+                             **feature_fn(windows, rate)})
+    features.insert(0, "participant_id", participant_id)
+    features["sampling_rate"] = round(rate, 6)
+    return features
+
+
+def source_fingerprints(output_dir, participant_id, sensor, output_format):
+    """(first, last, fingerprint) of every piece of converted data of a participant.
+
+    Taken from the processed-file manifest when there is one, otherwise from
+    the offset index of the sensor CSV. Files imported into the manifest from
+    an old path log have no sensor statistics, so when the participant has
+    any, the offset-index blocks are added as well.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        sources = []
+        unknown = False
+        for path, entry in load_manifest(manifest_path, compact=False)['files'].items():
+            if os.path.basename(path).split('_')[0] != participant_id:
+                continue
+            if not entry.get('sensors'):
+                unknown = True
+                continue
+            stats = entry['sensors'].get(sensor)
+            if stats and stats['first'] is not None:
+                sources.append((stats['first'], stats['last'], entry['sha256']))
+        if not unknown:
+            return sources
+        return sources + offset_index_sources(output_dir, participant_id, sensor, output_format)
+    return offset_index_sources(output_dir, participant_id, sensor, output_format)
+
+
+def offset_index_sources(output_dir, participant_id, sensor, output_format):
+    """(first, last, byte range) of every offset-index block of a participant."""
+    if output_format != 'csv':
+        return []
+    index = read_offset_index(os.path.join(output_dir, SENSOR_FILES[sensor]))
+    index = index[index['participant_id'] == participant_id]
+    return [(first, last, f"{start}-{stop}") for first, last, start, stop
+            in zip(index['first'], index['last'], index['start'], index['stop'])]
+
+
+def block_key(sources, participant_id, sensor, block_start, block_end, window_s, step_s):
+    """Cache key of a block: the parameters and the sources its windows can read.
+
+    None when no source reaches the block, so it has no windows.
+    """
+    window_us = int(window_s * 1e6)
+    reachable = sorted(fingerprint for first, last, fingerprint in sources
+                       if last >= block_start and first < block_end + window_us)
+    if not reachable:
+        return None
+    payload = json.dumps([FEATURES_VERSION, participant_id, sensor, block_start, window_s,
+                          step_s, reachable])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def window_features(output_dir, participant_id, sensor, window_s=WINDOW_S, step_s=STEP_S,
+                    start_us=None, end_us=None, output_format='csv', cache=True):
+    """Sliding-window features of one sensor of a participant, reusing cached blocks.
+
+    `sensor` is one of FEATURE_SENSORS (eda, bvp, accelerometer).
+    """
+    sensor = raw_sensor_name(sensor)
+    if sensor not in FEATURE_SENSORS:
+        raise ValueError(f"No window features for {sensor!r}; "
+                         f"expected one of {sorted(FEATURE_SENSORS)}.")
+    indexes = sensor_indexes(output_dir, [sensor], output_format)
+    if start_us is None or end_us is None:
+        span = participant_span(output_dir, participant_id, [sensor], output_format, indexes)
+        if span is None:
+            return pd.DataFrame()
+        start_us = span[0] if start_us is None else start_us
+        end_us = span[1] + 1 if end_us is None else end_us
+
+    block_us = int(CACHE_BLOCK_S * 1e6)
+    cache_dir = os.path.join(output_dir, CACHE_DIR, participant_id, sensor,
+                             f"window{window_s:g}-step{step_s:g}")
+    sources = source_fingerprints(output_dir, participant_id, sensor, output_format) \
+        if cache else []
+    blocks = []
+    for block_start in range(start_us // block_us * block_us, end_us, block_us):
+        block_end = block_start + block_us
+        if not cache:
+            blocks.append(compute_block(output_dir, participant_id, sensor, block_start,
+                                        block_end, window_s, step_s, output_format,
+                                        indexes[sensor]))
+            continue
+        key = block_key(sources, participant_id, sensor, block_start, block_end, window_s,
+                        step_s)
+        if key is None:
+            continue
+        path = os.path.join(cache_dir, f"{block_start}-{key}.csv")
+        if os.path.exists(path):
+            features = pd.read_csv(path, dtype={"participant_id": str},
+                                   float_precision='round_trip')
+        else:
+            features = compute_block(output_dir, participant_id, sensor, block_start, block_end,
+                                     window_s, step_s, output_format, indexes[sensor])
+            os.makedirs(cache_dir, exist_ok=True)
+            # Replace the results of this block computed from older sources with the
+            # same window and step
+            for stale in glob.glob(os.path.join(cache_dir, f"{block_start}-*.csv")):
+                os.remove(stale)
+            tmp_path = path + '.tmp'
+            features.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        blocks.append(features)
+    blocks = [block for block in blocks if len(block)]
+    if not blocks:
+        return pd.DataFrame()
+    features = pd.concat(blocks, ignore_index=True)
+    in_range = (features["window_start"] >= start_us) & (features["window_start"] < end_us)
+    return features[in_range].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    # Example usage: python sensor_features.py Output4 1-1-001 --window 60 --step 30
+    parser = argparse.ArgumentParser(description="Sliding-window EDA, BVP and accelerometer "
+                                                 "features of one participant.")
+    parser.add_argument("output_dir", help="folder written by the converters")
+    parser.add_argument("participant_id")
+    parser.add_argument("--sensors", nargs="+", default=sorted(FEATURE_SENSORS),
+                        choices=sorted(FEATURE_SENSORS))
+    parser.add_argument("--window", type=float, default=WINDOW_S, help="window length (s)")
+    parser.add_argument("--step", type=float, default=STEP_S, help="window step (s)")
+    parser.add_argument("--format", dest="output_format", default="csv",
+                        choices=["csv"] + sorted(OUTPUT_FORMATS))
+    parser.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="recompute every window instead of reusing cached blocks")
+    args = parser.parse_args()
+    for sensor in args.sensors:
+        features = window_features(args.output_dir, args.participant_id, sensor, args.window,
+                                   args.step, output_format=args.output_format, cache=args.cache)
+        path = os.path.join(args.output_dir, f"{args.participant_id}_{sensor}_features.csv")
+        features.to_csv(path, index=False)
+        print(f"{sensor}: {len(features)} windows -> {path}")
@@ -0,0 +1,244 @@
+import csv
+import io
+import os
+from csv_writers import format_rows, maybe_flush, open_output, write_text
+from output_backends import read_partitioned
+from pipeline_metrics import stage
+from sensor_decode import SENSOR_COLUMNS, SENSOR_FILES, TIMESTAMP_SCALE, iter_rows
+
+## Participant and time-range queries over the converter outputs.
+# Every sensor CSV gets a sparse offset index next to it (eda.csv ->
+# eda.csv.offsets.csv) with one line per block of at most INDEX_BLOCK_ROWS
+# rows of one participant:
+#   participant_id,first,last,start,stop,rows
+# where first/last are the smallest and largest timestamp of the block and
+# start/stop its byte range in the CSV. The converters append to it as they
+# write each chunk, so it is always in step with the CSV and is rolled back
+# with it. load() reads the index, seeks to the blocks that overlap the query
+# and parses only those bytes. For the parquet/feather outputs the same call
+# is answered by pyarrow.dataset with partition and row-group pruning, and
+# returns the same columns in the same order.
+#
+# The blocks' [first, last] are also the ranges the converter with
+# participant IDs checks new rows against, to skip rows already written
+# (offset_ranges()). An index built from an existing CSV therefore also
+# starts a block wherever the timestamps go back or jump by more than
+# INDEX_MAX_GAP_US, so no block spans a recording gap.
+#
+# Timestamps passed to load() are in microseconds for every sensor; they are
+# converted for sensors stored in another unit (systolic peaks, in ns).
+# pandas is only imported by the query functions, so the converters, which
+# just write the index, start without it.
+
+OFFSET_INDEX_SUFFIX = '.offsets.csv'
+INDEX_COLUMNS = ['participant_id', 'first', 'last', 'start', 'stop', 'rows']
+
+# Rows per index entry; a query reads at most one block too many at either end
+INDEX_BLOCK_ROWS = 10_000
+
+# Longest step between rows of a block of a rebuilt index (Avro chunks are ~30
+# minutes long); scaled for sensors whose timestamps are not in µs
+INDEX_MAX_GAP_US = 60 * 1_000_000
+
+
+def offset_index_name(filename):
+    """Name of the offset index kept next to an output CSV file."""
+    return filename + OFFSET_INDEX_SUFFIX
+
+
+def write_indexed_rows(writers, filename, header, columns, participant_id=None):
+    """Append decoded columns to a CSV file of a writer set and index their offsets.
+
+    With a participant_id the rows are led by it, as in avro_to_csv_with_ID.
+    Returns the index entries written.
+    """
+    index_name = offset_index_name(filename)
+    if index_name not in writers['files']:
+        # Index a CSV written before the offset index existed before appending to it
+        build_offset_index(os.path.join(writers['output_dir'], filename), overwrite=False)
+    first = offset = open_output(writers, filename, header)
+    open_output(writers, index_name, INDEX_COLUMNS)
+    prefix = () if participant_id is None else (participant_id,)
+    timestamps = next(iter(columns.values()))
+    with stage(f'write_csv.{filename}', rows=len(timestamps)) as counts:
+        entries = []
+        for start in range(0, len(timestamps), INDEX_BLOCK_ROWS):
+            stop = min(start + INDEX_BLOCK_ROWS, len(timestamps))
+            block = {name: col[start:stop] for name, col in columns.items()}
+            end = write_text(writers, filename, format_rows(iter_rows(block, *prefix)))
+            entries.append([participant_id or '', int(timestamps[start:stop].min()),
+                            int(timestamps[start:stop].max()), offset, end, stop - start])
+            offset = end
+        write_text(writers, index_name, format_rows(entries))
+        counts['bytes'] = offset - first
+    maybe_flush(writers)
+    return entries
+
+
+def build_offset_index(csv_path, block_rows=INDEX_BLOCK_ROWS, overwrite=True):
+    """Write the offset index of an existing CSV file in one pass over it.
+
+    Does nothing when the CSV is missing or empty, or when the index exists
+    and `overwrite` is False.
+    """
+    index_path = csv_path + OFFSET_INDEX_SUFFIX
+    if not overwrite and os.path.exists(index_path):
+        return
+    if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
+        return
+    scale = next((TIMESTAMP_SCALE.get(name, 1) for name, filename in SENSOR_FILES.items()
+                  if filename == os.path.basename(csv_path)), 1)
+    max_gap = INDEX_MAX_GAP_US * scale
+    entries = []
+    with open(csv_path, 'rb') as f:
+        header = f.readline().decode().strip().split(',')
+        has_participant = header[0] == 'participant_id'
+        block = None
+        offset = f.tell()
+        for line in f:
+            fields = line.split(b',', 2)
+            participant_id = fields[0].decode() if has_participant else ''
+            timestamp = int(fields[1] if has_participant else fields[0])
+            if (block is None or block[0] != participant_id or block[5] >= block_rows
+                    or not 0 <= timestamp - previous <= max_gap):
+                if block is not None:
+                    entries.append(block)
+                block = [participant_id, timestamp, timestamp, offset, offset, 0]
+            block[1] = min(block[1], timestamp)
+            block[2] = max(block[2], timestamp)
+            previous = timestamp
+            offset += len(line)
+            block[4] = offset
+            block[5] += 1
+        if block is not None:
+            entries.append(block)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(INDEX_COLUMNS)
+        writer.writerows(entries)
+    os.replace(tmp_path, index_path)
+
+
+def read_offset_index(csv_path):
+    """Load the offset index of a CSV file, building it first if it is missing."""
+    import pandas as pd
+    index_path = csv_path + OFFSET_INDEX_SUFFIX
+    if not os.path.exists(index_path):
+        build_offset_index(csv_path)
+    if not os.path.exists(index_path):
+        return pd.DataFrame(columns=INDEX_COLUMNS)
+    return pd.read_csv(index_path, dtype={'participant_id': str}, keep_default_na=False)
+
+
+def merge_ranges(ranges):
+    """Sort and merge overlapping [first, last] timestamp ranges."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def offset_ranges(csv_path):
+    """participant_id -> merged [[first, last], ...] of the blocks of a CSV's offset index.
+
+    Read with the csv module, so the converters still run without pandas.
+    The index is built first for a CSV written before it existed.
+    """
+    index_path = csv_path + OFFSET_INDEX_SUFFIX
+    if not os.path.exists(index_path):
+        build_offset_index(csv_path)
+    ranges = {}
+    if os.path.exists(index_path):
+        with open(index_path, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for participant_id, first, last, *_ in reader:
+                ranges.setdefault(participant_id, []).append([int(first), int(last)])
+    return {participant_id: merge_ranges(r) for participant_id, r in ranges.items()}
+
+
+def raw_sensor_name(sensor):
+    """rawData name of a sensor given either that name or its file name (systolic_peaks)."""
+    for name, filename in SENSOR_FILES.items():
+        if sensor in (name, os.path.splitext(filename)[0]):
+            return name
+    raise ValueError(f"Unknown sensor {sensor!r}; expected one of {sorted(SENSOR_FILES)}.")
+
+
+def read_byte_ranges(csv_path, ranges):
+    """Read the given (start, stop) byte ranges of a file, merging adjacent ones."""
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    with open(csv_path, 'rb') as f:
+        for start, stop in merged:
+            f.seek(start)
+            yield f.read(stop - start)
+
+
+def load(output_dir, sensor, participant_id=None, start_us=None, end_us=None, columns=None,
+         output_format='csv', index=None):
+    """Load the rows of a sensor for one participant with start_us <= timestamp < end_us.
+
+    Any of participant_id, start_us and end_us may be None to leave that side
+    open. Only the index blocks that overlap the query are read from a CSV.
+    Callers running many queries on one sensor can pass its `index` so it
+    is not read again each time: the read_offset_index() of a CSV, or the
+    output_backends.open_dataset() of the parquet/feather part files. A sensor
+    without a CSV, as when no file had rows of it, gives an empty frame with
+    the converter's columns.
+    """
+    import pandas as pd
+    name = raw_sensor_name(sensor)
+    scale = TIMESTAMP_SCALE.get(name, 1)
+    start = None if start_us is None else start_us * scale
+    end = None if end_us is None else end_us * scale
+    if output_format != 'csv':
+        rows = read_partitioned(output_dir, name, participant_id, columns=columns,
+                                output_format=output_format, start=start, end=end,
+                                dataset=index)
+        if columns is None:
+            # The columns of the CSV with participant IDs; the date partition is left out
+            rows = rows[['participant_id'] + [column for column in rows.columns
+                                              if column not in ('participant_id', 'date')]]
+        return rows
+
+    csv_path = os.path.join(output_dir, SENSOR_FILES[name])
+    if not os.path.exists(csv_path):
+        return pd.DataFrame(columns=columns or ['participant_id'] + SENSOR_COLUMNS[name])
+    with open(csv_path, 'r', newline='') as f:
+        header = f.readline().strip().split(',')
+    if index is None:
+        index = read_offset_index(csv_path)
+    mask = pd.Series(True, index=index.index)
+    if participant_id is not None:
+        mask &= index['participant_id'] == participant_id
+    if start is not None:
+        mask &= index['last'] >= start
+    if end is not None:
+        mask &= index['first'] < end
+    blocks = index[mask]
+
+    data = b''.join(read_byte_ranges(csv_path, zip(blocks['start'], blocks['stop'])))
+    if not data:
+        return pd.DataFrame(columns=columns or header)
+    rows = pd.read_csv(io.BytesIO(data), header=None, names=header,
+                       dtype={'participant_id': str})
+    # Blocks are whole, so trim the rows outside the query from the first and last ones
+    timestamp = rows[header[1] if header[0] == 'participant_id' else header[0]]
+    keep = pd.Series(True, index=rows.index)
+    if participant_id is not None and 'participant_id' in rows:
+        keep &= rows['participant_id'] == participant_id
+    if start is not None:
+        keep &= timestamp >= start
+    if end is not None:
+        keep &= timestamp < end
+    rows = rows[keep].reset_index(drop=True)
+    return rows if columns is None else rows[columns]
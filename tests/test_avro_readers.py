@@ -0,0 +1,35 @@
+import os
+import pytest
+from avro_stream import compare_readers
+from benchmark import write_synthetic_avro
+from empatica_convert import process_folder
+from sensor_decode import SENSOR_FILES
+
+pytest.importorskip("avro")
+pytest.importorskip("fastavro")
+
+
+def write_fixture(folder):
+    """One v6 file of a participant with several consecutive records."""
+    os.makedirs(folder)
+    path = os.path.join(folder, "1-1-001_1728000000.avro")
+    write_synthetic_avro(path, 1728000000, duration_s=120, records=4)
+    return path
+
+
+def test_readers_decode_the_same_records(tmp_path):
+    path = write_fixture(tmp_path / "avro")
+    assert compare_readers(path) == []
+
+
+def test_readers_write_identical_csvs(tmp_path):
+    write_fixture(tmp_path / "avro")
+    for reader in ("fastavro", "avro"):
+        process_folder(str(tmp_path / "avro"), str(tmp_path / reader), reader=reader)
+    assert (tmp_path / "fastavro" / SENSOR_FILES["eda"]).exists()
+    for filename in SENSOR_FILES.values():
+        fastavro_csv = tmp_path / "fastavro" / filename
+        avro_csv = tmp_path / "avro" / filename
+        assert fastavro_csv.exists() == avro_csv.exists()
+        if fastavro_csv.exists():
+            assert fastavro_csv.read_bytes() == avro_csv.read_bytes()
@@ -0,0 +1,85 @@
+import glob
+import json
+import os
+import numpy as np
+import pytest
+import decoded_cache
+import processed_manifest
+from benchmark import write_synthetic_avro
+from decoded_cache import decode_column, encode_column, open_decoded_cache
+from empatica_convert import process_folder
+
+START_S = 1728000000
+
+
+def output_bytes(output_dir):
+    """Content of every CSV file of an output folder, by file name."""
+    outputs = {}
+    for path in glob.glob(os.path.join(output_dir, "*.csv")):
+        with open(path, "rb") as f:
+            outputs[os.path.basename(path)] = f.read()
+    return outputs
+
+
+@pytest.mark.parametrize("output_modes", [None, {"accelerometer": "counts",
+                                                 "gyroscope": "counts"}])
+def test_cold_and_warm_cache_write_the_same_bytes(tmp_path, output_modes):
+    os.makedirs(tmp_path / "avro")
+    for seed, participant_id in enumerate(("1-1-001", "1-1-002")):
+        write_synthetic_avro(str(tmp_path / "avro" / f"{participant_id}_{START_S}.avro"),
+                             START_S, duration_s=120, records=2, seed=seed)
+    cache = open_decoded_cache(str(tmp_path / "cache"))
+    outputs = {}
+    for run, run_cache in (("none", None), ("cold", cache), ("warm", cache)):
+        process_folder(str(tmp_path / "avro"), str(tmp_path / run), decoded_cache=run_cache,
+                       output_modes=output_modes)
+        outputs[run] = output_bytes(str(tmp_path / run))
+    assert outputs["none"]
+    assert outputs["cold"] == outputs["none"]
+    assert outputs["warm"] == outputs["none"]
+
+    # IMU axes are stored as int32 ADC counts, the other floats as float32
+    entries = glob.glob(str(tmp_path / "cache" / "*.json"))
+    assert len(entries) == 2
+    with open(entries[0]) as f:
+        record = json.load(f)["records"][0]
+    assert record["accelerometer"]["columns"]["x"]["dtype"] == np.dtype(np.int32).str
+    assert "scale" in record["accelerometer"]["columns"]["x"]
+    assert record["eda"]["columns"]["eda"]["dtype"] == np.dtype(np.float32).str
+
+
+def test_columns_that_do_not_narrow_are_stored_as_decoded():
+    column = np.array([0.1, 1 / 3, 2.0])
+    stored, info = encode_column(column)
+    assert stored.dtype == np.float64
+    # ADC counts past int32 are kept as floats too
+    stored, info = encode_column(np.array([2.0 ** 40, 1.0]), scale=(1, 1))
+    assert stored.dtype != np.int32 and "scale" not in info
+    # Values off the ADC grid would not come back from int32 counts
+    column = np.array([0.5, 1.25, 3.0])
+    stored, info = encode_column(column, scale=(1, 1))
+    assert "scale" not in info
+    np.testing.assert_array_equal(decode_column(stored, info), column)
+    events = np.array([1728000000000000, 1728000000250000], dtype=np.int64)
+    stored, info = encode_column(events)
+    assert stored is events
+
+
+def test_cached_files_are_hashed_once(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "avro")
+    for participant_id in ("1-1-001", "1-1-002"):
+        write_synthetic_avro(str(tmp_path / "avro" / f"{participant_id}_{START_S}.avro"),
+                             START_S, duration_s=60)
+    hashed = []
+    file_sha256 = processed_manifest.file_sha256
+    for module in (processed_manifest, decoded_cache):
+        monkeypatch.setattr(module, "file_sha256",
+                            lambda path: hashed.append(path) or file_sha256(path))
+    process_folder(str(tmp_path / "avro"), str(tmp_path / "out"),
+                   decoded_cache=open_decoded_cache(str(tmp_path / "cache")))
+    assert len(hashed) == 2 and len(set(hashed)) == 2
+    manifest = processed_manifest.load_manifest(
+        str(tmp_path / "out" / processed_manifest.MANIFEST_FILE))
+    assert sorted(entry["sha256"] for entry in manifest["files"].values()) == \
+        sorted(os.path.splitext(os.path.basename(path))[0]
+               for path in glob.glob(str(tmp_path / "cache" / "*.json")))
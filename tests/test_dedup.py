@@ -0,0 +1,41 @@
+import glob
+import os
+import pandas as pd
+from benchmark import write_synthetic_avro
+from empatica_convert import process_folder
+from sensor_query import offset_ranges
+
+START_S = 1728000000
+
+
+def test_overlapping_file_appended_to_legacy_csv(tmp_path):
+    first = tmp_path / "first"
+    os.makedirs(first)
+    write_synthetic_avro(str(first / f"1-1-001_{START_S}.avro"), START_S, duration_s=300,
+                         records=3)
+    output_dir = tmp_path / "out"
+    process_folder(str(first), str(output_dir), incremental=False)
+    # A CSV written before the offset index existed
+    for index_path in glob.glob(str(output_dir / "*.offsets.csv")):
+        os.remove(index_path)
+    before = {name: pd.read_csv(output_dir / name) for name in ("eda.csv", "systolic_peaks.csv")}
+
+    # Starts halfway through the converted data and runs 750 s past it
+    second = tmp_path / "second"
+    os.makedirs(second)
+    write_synthetic_avro(str(second / f"1-1-001_{START_S + 450}.avro"), START_S + 450,
+                         duration_s=300, records=4, seed=1)
+    process_folder(str(second), str(output_dir), incremental=False)
+
+    eda = pd.read_csv(output_dir / "eda.csv")
+    assert eda["unix_timestamp"].is_unique
+    assert len(eda) == len(before["eda.csv"]) + 750 * 4
+    peaks = pd.read_csv(output_dir / "systolic_peaks.csv")
+    assert peaks["systolic_peak_timestamp"].is_monotonic_increasing
+    old_last = before["systolic_peaks.csv"]["systolic_peak_timestamp"].max()
+    assert (peaks["systolic_peak_timestamp"] > old_last).sum() == len(peaks) - len(
+        before["systolic_peaks.csv"])
+    # The legacy rows make one range, and each appended record at most one more
+    ranges = offset_ranges(str(output_dir / "systolic_peaks.csv"))["1-1-001"]
+    assert ranges[0] == [int(peaks["systolic_peak_timestamp"].min()), int(old_last)]
+    assert len(ranges) <= 4
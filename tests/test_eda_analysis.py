@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+from eda_analysis import scr_peaks
+
+
+def write_synthetic_eda(path, hours=3, seed=0, rates=(4, 4)):
+    """eda.csv of two participants: drifting tonic level, SCRs and noise at `rates` Hz."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for participant_id, rate in zip(("1-1-001", "1-1-002"), rates):
+        n = int(hours * 3600 * rate)
+        eda = 2 + np.cumsum(rng.normal(0, 0.002, n))
+        shape = np.arange(50 * rate)
+        for onset in rng.choice(n - len(shape), 300, replace=False):
+            eda[onset:onset + len(shape)] += (rng.uniform(0.01, 0.2)
+                                              * (1 - np.exp(-shape / 4)) * np.exp(-shape / 40))
+        eda += rng.normal(0, 0.003, n)
+        frames.append(pd.DataFrame({"participant_id": participant_id,
+                                    "unix_timestamp": (1728000000000000
+                                                       + np.arange(n) * 1_000_000 // rate),
+                                    "eda": eda}))
+    pd.concat(frames).to_csv(path, index=False)
+
+
+def test_peaks_do_not_depend_on_chunking(tmp_path):
+    eda_csv = tmp_path / "eda.csv"
+    write_synthetic_eda(eda_csv)
+    hourly, _ = scr_peaks(str(eda_csv), chunk_s=3600)
+    short, _ = scr_peaks(str(eda_csv), chunk_s=300)
+    assert len(hourly) > 1000
+    pd.testing.assert_frame_equal(hourly[["participant_id", "segment", "peak_timestamp"]],
+                                  short[["participant_id", "segment", "peak_timestamp"]])
+    # Amplitudes differ only by the filter's edge effects, far below MIN_AMPLITUDE
+    np.testing.assert_allclose(hourly["amplitude"], short["amplitude"], rtol=0, atol=1e-5)
+
+
+def test_sampling_rate_is_estimated_per_segment(tmp_path):
+    eda_csv = tmp_path / "eda.csv"
+    write_synthetic_eda(eda_csv, hours=1, rates=(4, 8))
+    peaks, segments = scr_peaks(str(eda_csv))
+    assert segments["sampling_rate"].tolist() == [4.0, 8.0]
+    np.testing.assert_allclose(segments["scr_per_minute"], segments["peaks"] / 60)
+    forced, _ = scr_peaks(str(eda_csv), sampling_rate=4.0)
+    first = peaks["participant_id"] == "1-1-001"
+    pd.testing.assert_frame_equal(peaks[first], forced[forced["participant_id"] == "1-1-001"])
@@ -0,0 +1,46 @@
+import os
+import pytest
+from benchmark import write_synthetic_avro
+from decoded_cache import open_decoded_cache
+from empatica_convert import process_folder
+from pipeline_metrics import start_metrics, stop_metrics
+
+START_S = 1728000000
+
+
+@pytest.fixture
+def avro_folder(tmp_path):
+    folder = tmp_path / "avro"
+    os.makedirs(folder)
+    for seed, participant_id in enumerate(("1-1-001", "1-1-002")):
+        write_synthetic_avro(str(folder / f"{participant_id}_{START_S}.avro"), START_S,
+                             duration_s=60, records=2, seed=seed)
+    return str(folder)
+
+
+def stage_counts(avro_folder, output_dir, workers, **kwargs):
+    """{stage: (calls, rows, bytes)} of a conversion run."""
+    start_metrics()
+    process_folder(avro_folder, output_dir, workers=workers, **kwargs)
+    return {s['stage']: (s['calls'], s['rows'], s['bytes']) for s in stop_metrics()['stages']}
+
+
+@pytest.mark.parametrize("stages, kwargs", [
+    (("read_avro", "decode", "output_modes"), {"output_modes": {"accelerometer": "summary:1"}}),
+    (("decoded_cache", "output_modes"), {"output_modes": {"accelerometer": "summary:1"},
+                                         "cache": True}),
+])
+def test_pool_workers_report_their_stages(tmp_path, avro_folder, stages, kwargs):
+    runs = {}
+    for workers in (1, 2):
+        run_kwargs = dict(kwargs)
+        if run_kwargs.pop("cache", False):
+            # Filled by a first run, so both measured runs read from it
+            cache = open_decoded_cache(str(tmp_path / "cache"))
+            process_folder(avro_folder, str(tmp_path / f"fill{workers}"), decoded_cache=cache)
+            run_kwargs["decoded_cache"] = cache
+        runs[workers] = stage_counts(avro_folder, str(tmp_path / f"out{workers}"), workers,
+                                     **run_kwargs)
+    for name in stages:
+        assert runs[2][name] == runs[1][name]
+        assert runs[2][name][0] >= 4
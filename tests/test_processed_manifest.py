@@ -0,0 +1,111 @@
+import glob
+import os
+import shutil
+import pytest
+import empatica_convert
+from benchmark import write_synthetic_avro
+from empatica_convert import open_manifest, process_folder
+from processed_manifest import MANIFEST_FILE, find_processed, load_manifest, normalize_path
+
+START_S = 1728000000
+
+
+def write_files(folder, count, duration_s=120):
+    """`count` consecutive two-record files of one participant."""
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(count):
+        start_s = START_S + i * 2 * duration_s
+        paths.append(str(folder / f"1-1-001_{start_s}.avro"))
+        write_synthetic_avro(paths[-1], start_s, duration_s, records=2, seed=i)
+    return paths
+
+
+def output_bytes(output_dir):
+    """Content of the CSVs and offset indexes of an output folder."""
+    return {os.path.basename(path): open(path, "rb").read()
+            for path in sorted(glob.glob(os.path.join(output_dir, "*.csv")))}
+
+
+def test_manifest_folder_is_created(tmp_path):
+    manifest_path = tmp_path / "state" / "manifest.json"
+    manifest = open_manifest(str(tmp_path / "out"), str(manifest_path))
+    assert manifest_path.parent.is_dir()
+    assert manifest["files"] == {}
+
+
+def test_conversion_into_a_new_folder_is_recorded(tmp_path):
+    pytest.importorskip("pyarrow")
+    os.makedirs(tmp_path / "avro")
+    avro_file = str(tmp_path / "avro" / "1-1-001_1728000000.avro")
+    write_synthetic_avro(avro_file, 1728000000, duration_s=60, records=2)
+    output_dir = tmp_path / "new" / "out"
+    process_folder(str(tmp_path / "avro"), str(output_dir), output_format="parquet")
+    manifest = load_manifest(str(output_dir / MANIFEST_FILE))
+    assert find_processed(manifest, avro_file) is not None
+    assert manifest["pending"] == {}
+
+
+# Without participant IDs no deduplication hides rows appended twice
+@pytest.mark.parametrize("participant_ids", [True, False])
+def test_interrupted_file_is_rolled_back(tmp_path, monkeypatch, participant_ids):
+    paths = write_files(tmp_path / "avro", 2)
+    expected = tmp_path / "expected"
+    process_folder(str(tmp_path / "avro"), str(expected), participant_ids=participant_ids)
+
+    output_dir = tmp_path / "out"
+    os.makedirs(tmp_path / "first")
+    shutil.copy(paths[0], tmp_path / "first")
+    process_folder(str(tmp_path / "first"), str(output_dir), participant_ids=participant_ids)
+    eda_rows = len(open(output_dir / "eda.csv").readlines())
+
+    def crash(*args, **kwargs):
+        raise KeyboardInterrupt
+    # The second file's rows are flushed, then the run stops before its commit
+    monkeypatch.setattr(empatica_convert, "commit_file", crash)
+    with pytest.raises(KeyboardInterrupt):
+        process_folder(str(tmp_path / "avro"), str(output_dir), participant_ids=participant_ids)
+    monkeypatch.undo()
+    manifest = load_manifest(str(output_dir / MANIFEST_FILE), compact=False)
+    assert list(manifest["pending"]) == [normalize_path(paths[1])]
+    assert normalize_path(paths[1]) not in manifest["files"]
+    assert len(open(output_dir / "eda.csv").readlines()) == eda_rows + 2 * 120 * 4
+
+    process_folder(str(tmp_path / "avro"), str(output_dir), participant_ids=participant_ids)
+    assert output_bytes(output_dir) == output_bytes(expected)
+    assert len(open(output_dir / "eda.csv").readlines()) == 1 + 2 * 2 * 120 * 4
+    manifest = load_manifest(str(output_dir / MANIFEST_FILE))
+    assert manifest["pending"] == {} and normalize_path(paths[1]) in manifest["files"]
+
+
+def test_renamed_copy_is_not_converted_again(tmp_path, capsys):
+    paths = write_files(tmp_path / "avro", 1)
+    output_dir = tmp_path / "out"
+    process_folder(str(tmp_path / "avro"), str(output_dir))
+    converted = output_bytes(output_dir)
+
+    os.makedirs(tmp_path / "avro" / "resynced")
+    copy = str(tmp_path / "avro" / "resynced" / "1-1-001_copy.avro")
+    shutil.copy(paths[0], copy)
+    capsys.readouterr()
+    process_folder(str(tmp_path / "avro"), str(output_dir))
+    assert "Processing" not in capsys.readouterr().out
+    assert output_bytes(output_dir) == converted
+    manifest = load_manifest(str(output_dir / MANIFEST_FILE))
+    assert manifest["files"][normalize_path(copy)]["sha256"] == \
+        manifest["files"][normalize_path(paths[0])]["sha256"]
+
+
+def test_file_removed_after_the_scan_is_skipped(tmp_path, monkeypatch, capsys):
+    paths = write_files(tmp_path / "avro", 2)
+    process_folder(paths[0], str(tmp_path / "out"))
+    gone = str(tmp_path / "avro" / f"1-1-001_{START_S - 240}.avro")
+    # Listed by the scan, then removed before the manifest is checked
+    monkeypatch.setattr(empatica_convert, "find_avro_files", lambda source: [gone] + paths)
+    process_folder(str(tmp_path / "avro"), str(tmp_path / "out"))
+    out = capsys.readouterr().out
+    assert f"Skipping {gone}: it was removed" in out
+    assert f"Skipping already processed file: {paths[0]}" in out
+    assert f"Finished processing {paths[1]}" in out
+    manifest = load_manifest(str(tmp_path / "out" / MANIFEST_FILE))
+    assert sorted(manifest["files"]) == sorted(normalize_path(path) for path in paths)
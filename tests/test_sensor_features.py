@@ -0,0 +1,40 @@
+import os
+import pandas as pd
+import pytest
+from benchmark import write_synthetic_avro
+from empatica_convert import process_folder
+from sensor_features import CACHE_DIR, window_features
+
+START_S = 1728000000
+
+
+@pytest.fixture
+def converted(tmp_path):
+    """One participant of two 10-minute records."""
+    os.makedirs(tmp_path / "avro")
+    write_synthetic_avro(str(tmp_path / "avro" / f"1-1-001_{START_S}.avro"), START_S,
+                         duration_s=600, records=2)
+    process_folder(str(tmp_path / "avro"), str(tmp_path / "csv"))
+    return str(tmp_path / "csv")
+
+
+@pytest.mark.parametrize("sensor", ["eda", "bvp", "accelerometer"])
+def test_cache_hits_match_a_recompute(converted, sensor):
+    uncached = window_features(converted, "1-1-001", sensor, cache=False)
+    cold = window_features(converted, "1-1-001", sensor)
+    warm = window_features(converted, "1-1-001", sensor)
+    assert len(uncached) > 10
+    pd.testing.assert_frame_equal(cold, uncached)
+    pd.testing.assert_frame_equal(warm, uncached, check_exact=True)
+
+
+def test_other_window_parameters_keep_their_blocks(converted):
+    cache_dir = os.path.join(converted, CACHE_DIR, "1-1-001", "eda")
+    window_features(converted, "1-1-001", "eda", window_s=60, step_s=30)
+    window_features(converted, "1-1-001", "eda", window_s=120, step_s=60)
+    before = {folder: sorted(os.listdir(os.path.join(cache_dir, folder)))
+              for folder in os.listdir(cache_dir)}
+    assert len(before) == 2 and all(before.values())
+    window_features(converted, "1-1-001", "eda", window_s=60, step_s=30)
+    assert {folder: sorted(os.listdir(os.path.join(cache_dir, folder)))
+            for folder in os.listdir(cache_dir)} == before
@@ -0,0 +1,65 @@
+import os
+import pandas as pd
+import pytest
+from benchmark import write_synthetic_avro
+from empatica_convert import process_folder
+from sensor_query import INDEX_BLOCK_ROWS, load, raw_sensor_name, read_offset_index
+from sensor_decode import SENSOR_FILES, TIMESTAMP_SCALE
+
+START_S = 1728000000
+
+
+@pytest.fixture(scope="module")
+def converted(tmp_path_factory):
+    """Two participants of two 5-minute records each, as CSV and as parquet."""
+    root = tmp_path_factory.mktemp("query")
+    os.makedirs(root / "avro")
+    for seed, participant_id in enumerate(("1-1-001", "1-1-002")):
+        write_synthetic_avro(str(root / "avro" / f"{participant_id}_{START_S}.avro"), START_S,
+                             duration_s=300, records=2, seed=seed)
+    process_folder(str(root / "avro"), str(root / "csv"))
+    return root
+
+
+def expected_rows(output_dir, sensor, participant_id, start_us, end_us):
+    """The rows of a full read_csv with the query applied as a pandas filter."""
+    name = raw_sensor_name(sensor)
+    rows = pd.read_csv(os.path.join(output_dir, SENSOR_FILES[name]),
+                       dtype={"participant_id": str})
+    scale = TIMESTAMP_SCALE.get(name, 1)
+    timestamp = rows[rows.columns[1]]
+    keep = ((rows["participant_id"] == participant_id) & (timestamp >= start_us * scale)
+            & (timestamp < end_us * scale))
+    return rows[keep].reset_index(drop=True)
+
+
+@pytest.mark.parametrize("sensor", ["accelerometer", "eda", "systolic_peaks"])
+def test_load_matches_a_filtered_read_csv(converted, sensor):
+    output_dir = str(converted / "csv")
+    for start_us, end_us in ((START_S * 10**6, (START_S + 600) * 10**6),
+                             ((START_S + 123) * 10**6 + 1, (START_S + 457) * 10**6 + 3)):
+        pd.testing.assert_frame_equal(
+            load(output_dir, sensor, "1-1-002", start_us, end_us),
+            expected_rows(output_dir, sensor, "1-1-002", start_us, end_us))
+
+
+def test_load_cuts_inside_a_block(converted):
+    output_dir = str(converted / "csv")
+    index = read_offset_index(os.path.join(output_dir, "accelerometer.csv"))
+    block = index[(index["participant_id"] == "1-1-001") & (index["rows"] == INDEX_BLOCK_ROWS)]
+    first, last = int(block["first"].iloc[0]), int(block["last"].iloc[0])
+    start_us, end_us = first + (last - first) // 3, last - (last - first) // 3
+    rows = load(output_dir, "accelerometer", "1-1-001", start_us, end_us)
+    assert 0 < len(rows) < INDEX_BLOCK_ROWS
+    pd.testing.assert_frame_equal(
+        rows, expected_rows(output_dir, "accelerometer", "1-1-001", start_us, end_us))
+
+
+def test_formats_return_the_same_columns(converted, tmp_path):
+    pytest.importorskip("pyarrow")
+    process_folder(str(converted / "avro"), str(tmp_path), output_format="parquet")
+    for sensor in ("accelerometer", "systolic_peaks"):
+        csv_rows = load(str(converted / "csv"), sensor, "1-1-001")
+        parquet_rows = load(str(tmp_path), sensor, "1-1-001", output_format="parquet")
+        assert list(parquet_rows.columns) == list(csv_rows.columns)
+        assert len(parquet_rows) == len(csv_rows)
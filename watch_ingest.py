@@ -0,0 +1,304 @@
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+from csv_writers import csv_writers
+from empatica_convert import ingest_files, main, open_manifest, unprocessed_files
+from parallel_ingest import avro_sort_key
+
+## Long-running ingestion of Avro files as they are synced.
+# process_folder() globs the whole tree and checks every path against the
+# manifest, so on a large sync folder a run spends minutes finding nothing
+# new. watch_folder() instead follows the tree as it changes:
+#   inotify - the kernel reports files created, written or moved into any
+#             directory of the tree (Linux; no extra package, through libc)
+#   poll    - every POLL_INTERVAL_S the directories are stat()ed and only
+#             those whose mtime changed are listed again, so a poll that
+#             finds nothing costs one stat per directory
+# A new file is only ingested once its size and mtime have not changed for
+# SETTLE_S seconds, so files still being written by the sync client are left
+# alone. Settled files go through a queue of at most QUEUE_SIZE paths to the
+# writer, which ingests up to BATCH_SIZE at a time in (participant,
+# timestampStart) order with the decode pool of process_folder(). When the
+# writer falls behind, as during a bulk re-sync, the watcher blocks on the
+# full queue and stops reading events (inotify keeps them, and an overflow
+# falls back to a rescan), so memory stays bounded by the queue and the
+# 2 x workers files the decode pool holds.
+#
+# Every file is committed to the manifest as it is written, so the daemon can
+# be stopped at any time with Ctrl+C; on restart the existing files are
+# rescanned once and those already in the manifest are skipped.
+
+POLL_INTERVAL_S = 2.0
+SETTLE_S = 5.0
+QUEUE_SIZE = 64
+BATCH_SIZE = 16
+
+# A listing is only reused when the directory changed longer ago than this, so
+# files added within the mtime resolution of the file system are not missed.
+MTIME_SLACK_NS = 2_000_000_000
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def is_avro(name):
+    return name.endswith(".avro") and not name.startswith(".")
+
+
+def scan_directories(folder_path, listings):
+    """Avro files of the directories under folder_path whose listing changed.
+
+    `listings` maps each directory to (mtime_ns, subdirectories) of its last
+    listing and is updated in place; it starts empty, so the first scan
+    returns every file.
+    """
+    found = set()
+    stack = [folder_path]
+    while stack:
+        directory = stack.pop()
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            listings.pop(directory, None)
+            continue
+        listing = listings.get(directory)
+        if listing is not None and listing[0] == mtime_ns:
+            stack.extend(listing[1])
+            continue
+        subdirectories = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirectories.append(entry.path)
+                elif is_avro(entry.name):
+                    found.add(entry.path)
+        recent = time.time_ns() - mtime_ns < MTIME_SLACK_NS
+        listings[directory] = (None if recent else mtime_ns, subdirectories)
+        stack.extend(subdirectories)
+    return found
+
+
+def iter_changes_poll(folder_path, interval_s=POLL_INTERVAL_S):
+    """Yield the Avro files of changed directories every interval_s (all of them first)."""
+    listings = {}
+    while True:
+        yield scan_directories(folder_path, listings)
+        time.sleep(interval_s)
+
+
+def load_libc_inotify():
+    """libc when it provides inotify, otherwise None."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def iter_changes_inotify(folder_path, interval_s=POLL_INTERVAL_S):
+    """Yield the Avro files inotify reports as changed, at least every interval_s.
+
+    The first batch is every file already in the tree. Directories created
+    later are watched as they appear and scanned for files that landed in
+    them before their watch was added.
+    """
+    libc = load_libc_inotify()
+    if libc is None:
+        raise OSError("inotify is not available on this system.")
+    fd = libc.inotify_init1(os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    watches = {}
+
+    def watch_tree(root):
+        """Watch root and every directory below it; return the Avro files in them."""
+        found = set()
+        for dirpath, _, filenames in os.walk(root):
+            wd = libc.inotify_add_watch(fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"Cannot watch {dirpath}: {os.strerror(errno)}")
+            watches[wd] = dirpath
+            found.update(os.path.join(dirpath, name) for name in filenames if is_avro(name))
+        return found
+
+    try:
+        yield watch_tree(folder_path)
+        while True:
+            changed = set()
+            if select.select([fd], [], [], interval_s)[0]:
+                data = os.read(fd, 64 * 1024)
+                offset = 0
+                while offset < len(data):
+                    wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    offset += INOTIFY_EVENT.size
+                    name = data[offset:offset + length].rstrip(b"\0").decode()
+                    offset += length
+                    if mask & IN_Q_OVERFLOW:
+                        # Events were dropped, so look at the whole tree again
+                        changed |= watch_tree(folder_path)
+                    elif mask & IN_IGNORED:
+                        watches.pop(wd, None)
+                    elif wd in watches and name:
+                        path = os.path.join(watches[wd], name)
+                        if mask & IN_ISDIR:
+                            if mask & (IN_CREATE | IN_MOVED_TO):
+                                changed |= watch_tree(path)
+                        elif is_avro(name):
+                            changed.add(path)
+            yield changed
+    finally:
+        os.close(fd)
+
+
+# Available watchers, preferred first
+WATCHERS = {
+    "inotify": iter_changes_inotify,
+    "poll": iter_changes_poll,
+}
+
+
+def default_watcher():
+    return "inotify" if load_libc_inotify() is not None else "poll"
+
+
+def iter_changes(folder_path, watcher=None, interval_s=POLL_INTERVAL_S):
+    """Yield sets of new or changed Avro files, falling back to polling if inotify fails."""
+    watcher = watcher or default_watcher()
+    changes = WATCHERS[watcher](folder_path, interval_s)
+    try:
+        first = next(changes)
+    except OSError as e:
+        if watcher == "poll":
+            raise
+        # e.g. the tree has more directories than fs.inotify.max_user_watches
+        print(f"Cannot use {watcher} ({e}); polling every {interval_s} s instead.")
+        changes = iter_changes_poll(folder_path, interval_s)
+        first = next(changes)
+    yield first
+    yield from changes
+
+
+def file_state(path):
+    """(size, mtime_ns) of a file, or None when it is gone."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def settled_files(candidates, settle_s, now):
+    """Remove and return the candidates whose size and mtime held still for settle_s.
+
+    `candidates` maps paths to (state, time the state was first seen).
+    """
+    settled = []
+    for path, (state, since) in list(candidates.items()):
+        current = file_state(path)
+        if current is None:
+            del candidates[path]
+        elif current != state:
+            candidates[path] = (current, now)
+        elif now - since >= settle_s:
+            settled.append((path, state))
+            del candidates[path]
+    return settled
+
+
+def watch_files(folder_path, ready, stop, watcher=None, interval_s=POLL_INTERVAL_S,
+                settle_s=SETTLE_S):
+    """Put every Avro file that settles under folder_path on the `ready` queue.
+
+    Blocks while the queue is full. A file is queued again only when it
+    changes after being queued.
+    """
+    candidates = {}
+    queued = {}
+    for changed in iter_changes(folder_path, watcher, interval_s):
+        now = time.monotonic()
+        for path in changed:
+            if path not in candidates and queued.get(path) != file_state(path):
+                candidates[path] = (None, now)
+        settled = settled_files(candidates, settle_s, now)
+        for path, state in sorted(settled, key=lambda item: avro_sort_key(item[0])):
+            while not stop.is_set():
+                try:
+                    ready.put(path, timeout=interval_s)
+                    break
+                except queue.Full:
+                    pass
+            queued[path] = state
+        if stop.is_set():
+            return
+
+
+def watch_folder(folder_path, output_dir, workers=1, output_format='csv', reader=None,
+                 manifest_path=None, watcher=None, interval_s=POLL_INTERVAL_S, settle_s=SETTLE_S,
+                 queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, decoded_cache=None,
+                 participant_ids=True, output_modes=None, import_log=None):
+    """Ingest Avro files as they appear under folder_path until interrupted.
+
+    Writes the same outputs and manifest as process_folder() with the same
+    arguments.
+    """
+    watcher = watcher or default_watcher()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = open_manifest(output_dir, manifest_path, import_log)
+    ready = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def run_watcher():
+        try:
+            watch_files(folder_path, ready, stop, watcher, interval_s, settle_s)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run_watcher, name="watch_files", daemon=True)
+    thread.start()
+    print(f"Watching {folder_path} for new Avro files ({watcher}); press Ctrl+C to stop.")
+    try:
+        with csv_writers(output_dir) as writers:
+            while thread.is_alive() or not ready.empty():
+                try:
+                    batch = [ready.get(timeout=interval_s)]
+                except queue.Empty:
+                    continue
+                while len(batch) < batch_size:
+                    try:
+                        batch.append(ready.get_nowait())
+                    except queue.Empty:
+                        break
+                new_files = unprocessed_files(manifest, sorted(set(batch), key=avro_sort_key))
+                ingest_files(new_files, output_dir, manifest, writers, workers, output_format,
+                             reader, decoded_cache, participant_ids, output_modes)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        stop.set()
+    if errors:
+        raise errors[0]
+
+
+if __name__ == "__main__":
+    # Example usage: python watch_ingest.py C:/Users/q1n/Documents/Empatica Output4 --workers 4
+    # The same as empatica_convert.py --watch, with all of its options
+    main(watch=True)